@@ -0,0 +1,184 @@
+import atexit
+import os
+import signal
+import threading
+import time
+
+# Buffered output shared by the DAQ writers. Rows are written to a large
+# userspace buffer and flushed to the file when the pending data reaches a
+# byte count, a row count or an age, whichever comes first. The age is also
+# checked by a timer thread, so pending data reaches the file even when no
+# more rows come. Every open output is flushed on SIGINT/SIGTERM and at
+# interpreter exit.
+
+# how often the timer thread looks for outputs with old pending data
+TIMER_TICK = 0.1
+
+
+class FlushPolicy:
+    def __init__(self, max_bytes=1 << 20, max_rows=0, max_interval=1.0):
+        # 0 disables the corresponding criterion
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.max_interval = max_interval
+
+    @classmethod
+    def parse(cls, text):
+        # "always" or a comma-separated list like "bytes=65536,rows=100,interval=0.5"
+        if text == "always":
+            return cls(max_bytes=0, max_rows=1, max_interval=0)
+        policy = cls(max_bytes=0, max_rows=0, max_interval=0)
+        for item in text.split(","):
+            key, _, value = item.partition("=")
+            key = key.strip()
+            if key == "bytes":
+                policy.max_bytes = int(value)
+            elif key == "rows":
+                policy.max_rows = int(value)
+            elif key == "interval":
+                policy.max_interval = float(value)
+            else:
+                raise ValueError(f"E: unknown flush policy item '{item}' - use bytes=, rows=, interval= or always")
+        return policy
+
+    def __str__(self):
+        return f"bytes={self.max_bytes},rows={self.max_rows},interval={self.max_interval}"
+
+
+_outputs = set()
+_previous_handlers = {}
+_timer = None
+
+
+def _flush_all():
+    for out in list(_outputs):
+        try:
+            out.flush()
+        except Exception as e:
+            print(f"E: final flush of {out.name} failed: {e}")
+
+
+def _on_signal(signum, frame):
+    _flush_all()
+    previous = _previous_handlers.get(signum)
+    if callable(previous):
+        previous(signum, frame)
+    elif previous == signal.SIG_DFL:
+        raise SystemExit(128 + signum)
+
+
+def _flush_due():
+    while True:
+        time.sleep(TIMER_TICK)
+        for out in list(_outputs):
+            try:
+                out.flush_due()
+            except Exception as e:
+                print(f"E: timed flush of {out.name} failed: {e}")
+
+
+def start_flush_timer():
+    global _timer
+    if _timer is None:
+        _timer = threading.Thread(target=_flush_due, name="flush-timer", daemon=True)
+        _timer.start()
+
+
+def _after_fork():
+    # the timer thread does not survive the fork
+    global _timer
+    _outputs.clear()
+    _timer = None
+
+
+def install_signal_flush():
+    if _previous_handlers:
+        return
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            _previous_handlers[signum] = signal.signal(signum, _on_signal)
+        except ValueError:
+            # not the main thread, rely on atexit only
+            pass
+
+
+# any output with name, flush() and flush_due() can take part in the timed,
+# signal and exit flushes
+def register_output(out, timed=True):
+    _outputs.add(out)
+    install_signal_flush()
+    if timed:
+        start_flush_timer()
+
+
+def unregister_output(out):
+    _outputs.discard(out)
+
+
+# a forked child must not flush the buffers it inherited from its parent
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(_flush_all)
+
+
+class BufferedOutput:
+    def __init__(self, filename, policy=None, binary=False):
+        self.name = filename
+        self.policy = policy if policy is not None else FlushPolicy()
+        buffering = max(self.policy.max_bytes, 1 << 16)
+        if binary:
+            self.file = open(filename, "wb", buffering=buffering)
+        else:
+            self.file = open(filename, "w", newline="", buffering=buffering)
+        self.bytes_written = 0
+        self.pending_bytes = 0
+        self.pending_rows = 0
+        self.last_flush = time.monotonic()
+        # the timer thread flushes while the owner writes (and so may the
+        # signal handler, in the middle of a write of the same thread)
+        self.lock = threading.RLock()
+        register_output(self, bool(self.policy.max_interval))
+
+    def write(self, data):
+        with self.lock:
+            self.file.write(data)
+            n = len(data)
+            self.bytes_written += n
+            self.pending_bytes += n
+        return n
+
+    # called once the rows of a logical record are written
+    def commit(self, rows=1):
+        self.pending_rows += rows
+        p = self.policy
+        if ((p.max_rows and self.pending_rows >= p.max_rows) or
+                (p.max_bytes and self.pending_bytes >= p.max_bytes) or
+                (p.max_interval and time.monotonic() - self.last_flush >= p.max_interval) or
+                not (p.max_rows or p.max_bytes or p.max_interval)):
+            self.flush()
+
+    # pending data older than the interval, called by the timer thread
+    def flush_due(self):
+        p = self.policy
+        if p.max_interval and self.pending_bytes and time.monotonic() - self.last_flush >= p.max_interval:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.flush()
+            self.pending_bytes = 0
+            self.pending_rows = 0
+            self.last_flush = time.monotonic()
+
+    def close(self):
+        unregister_output(self)
+        self.flush()
+        with self.lock:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
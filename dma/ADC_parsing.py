@@ -1,168 +1,555 @@
 import multiprocessing
+import asyncio
 import zmq
-import struct
+import zmq.asyncio
 import argparse
 import os
 import sys
 import csv
 import time
+import signal
+import functools
+import glob
+
+import numpy as np
+
+from adc_capture import CaptureWriter
+from adc_ring import EMPTY_FRAMES, OVERFLOW_POLICIES, PARSE_ERRORS, PARSED_WRITE_ERRORS, PARTIAL_FRAMES, RAW_WRITE_ERRORS, ShmRing
+from adc_pool import ParserPool, decode_frames
+from adc_output import PARSED_FLUSH, PARSED_FORMATS, check_files_exist, open_hit_writer
+from adc_index import INDEX_EVERY
+from adc_histo import HISTO_ENDPOINT, SNAPSHOT_INTERVAL, HistogramStage
+from adc_crc import CRC_MODES, CrcStage
+from adc_filter import FilterStage, parse_thresholds, parse_window
+from adc_summary import SummaryStage
+from adc_rates import RATES_ENDPOINT, RATES_INTERVAL, RateCounter, RatePublisher
+from adc_events import SORT_WINDOW, EventStage
+from adc_coinc import COINC_MULTIPLICITY, CoincidenceStage
+from adc_stages import finish_stages, output_dtype, run_stages
+from adc_decode import HIT_DTYPE, HIT_DTYPE_CRC, parse_channels
+from adc_rotate import COMPRESS_CODECS, RotatingWriter, RotationPolicy, check_codec
+from adc_perf import PERF_ENDPOINT, Perf, process_endpoint
+from adc_ingest import INGEST_MODES, RAW_QUEUE, RawWriterThread
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from buffered_output import BufferedOutput, FlushPolicy
 
 def get_time():
     return time.strftime("%Y_%m_%d_%H", time.gmtime(time.time()))
 
-def get_file_name(time_info, name_file, suffix = ""):
-    return str(name_file) + "_" + str(time_info) + suffix + ".csv"
+def get_file_name(time_info, name_file, suffix = "", ext = ".csv"):
+    return str(name_file) + "_" + str(time_info) + suffix + ext
+
+def get_segment_name(name_file, suffix, ext, seq):
+    return get_file_name(get_time(), name_file, f"_{seq:03d}" + suffix, ext)
+
+def status_line(stats, last, dt):
+    # rates since the last status line, loss counters since the start
+    frames = stats['frames_in'] - last['frames_in']
+    nbytes = stats['bytes_in'] - last['bytes_in']
+    blocked = (stats['blocked_us'] - last['blocked_us']) / 1e6
+    return (f"I: status: in {frames / dt:.0f} frames/s {nbytes / dt / 1e6:.2f} MB/s, parsed {(stats['hits_parsed'] - last['hits_parsed']) / dt:.0f} hits/s, "
+            f"ring {stats['used']}/{stats['capacity']} bytes (hwm {stats['high_water_mark']}), writer blocked {blocked / dt * 100:.0f}%, "
+            f"dropped {stats['dropped_frames']} frames, partial {stats['partial_frames']}, empty {stats['empty_frames']}, "
+            f"parse errors {stats['parse_errors']}, write errors raw {stats['raw_write_errors']} parsed {stats['parsed_write_errors']}")
 
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('-f', '--filename', action='store', type=str, help='output filename', default="output")
-    return parser.parse_args()
-
-
-def check_file_exists(fname):
-    if os.path.exists(fname):
-        while True:
-            res = input(f'I: file {fname} exists - do you want overwrite (Y/N) ')
-            if res.lower() in ["y", "yes"]:
-                break
-            elif res.lower() in ["n", "no"]:
-                print("E: specify different filename")
-                sys.exit(-1)
+    parser.add_argument('--per-board', action='store_true', help='one raw output, parsed output and set of stages per connected board, named <filename>_board<N>_... (default: all boards in one output)')
+    parser.add_argument('--raw-format', action='store', choices=['csv', 'bin'], help='raw capture format: hex text CSV or binary frames (default: csv)', default="csv")
+    parser.add_argument('--raw-flush', action='store', type=FlushPolicy.parse, help='raw output flush policy, e.g. bytes=1048576,rows=0,interval=1 or always (default: bytes=1048576,interval=1)', default="bytes=1048576,interval=1")
+    parser.add_argument('--rotate', action='store', type=RotationPolicy.parse, help='split the raw and parsed outputs in segments: hourly or bytes=N,interval=S (default: one file per run)')
+    parser.add_argument('--compress', action='store', choices=COMPRESS_CODECS, help='compress closed segments in the background (default: none)', default="none")
+    parser.add_argument('--ring-size', action='store', type=int, help='writer to parser ring buffer size in MB (default: 64)', default=64)
+    parser.add_argument('--overflow', action='store', choices=OVERFLOW_POLICIES, help='ring buffer overflow policy: block the writer or drop and count frames (default: block)', default="block")
+    parser.add_argument('--ingest', action='store', choices=INGEST_MODES, help='receive loop: one blocking loop, or asyncio with the raw output on its own thread (default: loop)', default="loop")
+    parser.add_argument('--raw-queue', action='store', type=int, help=f'messages queued for the raw output thread of the asyncio ingest (default: {RAW_QUEUE})', default=RAW_QUEUE)
+    parser.add_argument('--rcvhwm', action='store', type=int, help='ZMQ receive high-water mark of the ADC socket in messages, 0 for no limit (default: 1000)', default=1000)
+    parser.add_argument('--status-interval', action='store', type=float, help='seconds between status lines with rates, ring fill and loss counters, 0 to disable (default: 10)', default=10)
+    parser.add_argument('-j', '--workers', action='store', type=int, help='number of parser worker processes (default: 1)', default=1)
+    parser.add_argument('--parsed-format', action='store', choices=PARSED_FORMATS, help='parsed hits format: text CSV or a directory of typed column chunks (default: csv)', default="csv")
+    parser.add_argument('--parsed-flush', action='store', type=FlushPolicy.parse, help=f'parsed output flush policy, same syntax as --raw-flush; npz cuts a shorter row group (default: {PARSED_FLUSH["csv"]} for csv, {PARSED_FLUSH["npz"]} for npz)')
+    parser.add_argument('--index', action='store_true', help='write a sparse time index next to the parsed hits, for adc_index.py queries')
+    parser.add_argument('--index-every', action='store', type=int, help=f'hits per index block of a CSV output (default: {INDEX_EVERY}, row groups for npz)', default=INDEX_EVERY)
+    parser.add_argument('--crc', action='store', choices=CRC_MODES, help='CRC check: off, tag hits with a CRC_ok column, or drop bad hits (default: off)', default="off")
+    parser.add_argument('--summary', action='store_true', help='write per-second per-channel hit counts, energy mean/RMS, ToT mean and CRC failures to <filename>_summary, before any filter; hits failing the CRC are left out of the aggregates only with --crc tag or drop')
+    parser.add_argument('--keep-channels', action='store', type=parse_channels, help='write only the hits of these channels, e.g. 0-6 (default: all)')
+    parser.add_argument('--energy-min', action='store', type=parse_thresholds, help='write only the hits at or above this energy: 100, or per channel 0=120,3=90, or 100,3=250 (default: no threshold)')
+    parser.add_argument('--tot-window', action='store', type=parse_window, help='write only the hits with a ToT in this range, e.g. 2-40 (default: any)')
+    parser.add_argument('--sort-window', action='store', type=float, help='time-sort the parsed hits across channels, holding them back up to this many ms, and add a 64-bit Timestamp column (default: 0, arrival order)', default=0)
+    parser.add_argument('--coinc-window', action='store', type=float, help='find coincidences within this many ns and write them to <filename>_coinc, implies --sort-window (default: 0, off)', default=0)
+    parser.add_argument('--coinc-multiplicity', action='store', type=int, help=f'minimum number of different channels in a coincidence (default: {COINC_MULTIPLICITY})', default=COINC_MULTIPLICITY)
+    parser.add_argument('--coinc-channels', action='store', type=parse_channels, help='channels taking part in coincidences, e.g. 0-6 or 0,2,4 (default: all)')
+    parser.add_argument('--rates', action='store_true', help='publish live per-channel hit rates, frames/s and bytes/s from the writer')
+    parser.add_argument('--rates-endpoint', action='store', type=str, help=f'PUB socket for the rates (default: {RATES_ENDPOINT})', default=RATES_ENDPOINT)
+    parser.add_argument('--rates-interval', action='store', type=float, help=f'seconds between rate messages (default: {RATES_INTERVAL})', default=RATES_INTERVAL)
+    parser.add_argument('--histograms', action='store_true', help='keep per-channel Energy/ToT/TDC histograms during the run')
+    parser.add_argument('--histo-interval', action='store', type=float, help=f'histogram snapshot interval in seconds (default: {SNAPSHOT_INTERVAL})', default=SNAPSHOT_INTERVAL)
+    parser.add_argument('--histo-endpoint', action='store', type=str, help=f'local socket answering histogram queries, empty to disable (default: {HISTO_ENDPOINT})', default=HISTO_ENDPOINT)
+    parser.add_argument('--perf-endpoint', action='store', type=str, help=f'local socket of the writer hot-path timings, the parser uses the next port, empty to disable; SIGUSR1 prints them (default: {PERF_ENDPOINT})', default=PERF_ENDPOINT)
+    args = parser.parse_args()
+    if args.parsed_flush is None:
+        args.parsed_flush = FlushPolicy.parse(PARSED_FLUSH[args.parsed_format])
+    return args
+
+
+def hex_rows(words, end):
+    # 8 words per row as "wwww wwww ... wwww" followed by end, built in one go
+    n = len(words) // 8
+    digits = np.frombuffer(words[:n * 8].astype(">u2").tobytes().hex().encode(), dtype=np.uint8)
+    rows = np.full((n, 40 + len(end) - 1), ord(" "), dtype=np.uint8)
+    rows[:, :40].reshape(n, 8, 5)[:, :, :4] = digits.reshape(n, 8, 4)
+    rows[:, 39:] = np.frombuffer(end.encode(), dtype=np.uint8)
+    return rows.tobytes().decode()
+
+
+def write_hex_rows(file, part, perf=None):
+    words = np.frombuffer(part, dtype=np.uint16, count=len(part) // 2)
+    n = len(words) // 8
+    # the console dump keeps a space after every word, a partial row stays unterminated
+    sys.stdout.write(hex_rows(words, " \n") + "".join(f"{w:04x} " for w in words[n * 8:].tolist()))
+    if perf is not None and perf.timing:
+        perf.lap("console")
+    rows = hex_rows(words, "\r\n")
+    if perf is not None and perf.timing:
+        perf.lap("hex_format")
+    try:
+        file.write(rows)
+        file.commit(n)
+    except Exception as e:
+        print(f"It was not possible to write the data on the file: {e}")
+
+
+class HexRowWriter:
+    def __init__(self, filename, policy=None, perf=None):
+        self.file = BufferedOutput(filename, policy)
+        self.writer = csv.DictWriter(self.file, fieldnames=["DMA data row"], dialect='excel')
+        self.writer.writeheader()
+        self.perf = perf
+
+    def write(self, part, t=None):
+        # t: receive time, the hex rows do not keep it
+        write_hex_rows(self.file, part, self.perf)
+
+    @property
+    def bytes_written(self):
+        return self.file.bytes_written
+
+    def close(self):
+        self.file.close()
+
+
+def board_index(identity):
+    # boards connect with a 1-byte identity, ZMQ gives peers without one 5 bytes
+    # (0 and a counter): the last 4 bytes fit the board field of the ring
+    return int.from_bytes(identity[-4:], "big")
+
+
+def board_file_name(name_file, board):
+    return f"{name_file}_board{board}"
+
+
+def raw_output(args, name_file):
+    # the file to open, or the manifest listing its segments, and how to rotate it
+    ext = ".bin" if args.raw_format == "bin" else ".csv"
+    if args.rotate is None:
+        return get_file_name(get_time(), name_file, ext=ext), None
+    manifest = get_file_name(get_time(), name_file, "_manifest")
+    return manifest, functools.partial(RotatingWriter, segment_name=functools.partial(get_segment_name, name_file, "", ext),
+                                       policy=args.rotate, codec=args.compress, manifest=manifest)
+
+
+def parsed_output(args, name_file):
+    ext = "" if args.parsed_format == "npz" else ".csv"
+    if args.rotate is None:
+        return get_file_name(get_time(), name_file, "_parsed", ext=ext), None
+    manifest = get_file_name(get_time(), name_file, "_parsed_manifest")
+    return manifest, functools.partial(RotatingWriter, segment_name=functools.partial(get_segment_name, name_file, "_parsed", ext),
+                                       policy=args.rotate, codec=args.compress, manifest=manifest)
+
+
+def parse_stages(args, name_file, histo_endpoint):
+    # the parse stages and the files they write: the summary sees every hit
+    # and its CRC (decoded for it even with --crc off, then only reported and
+    # the CRC stage removes the column again), the filters come right after the CRC check so the
+    # rejected hits never reach the other stages
+    stages = []
+    files = []
+    if args.summary:
+        file_n_summary = get_file_name(get_time(), name_file, "_summary", ext="" if args.parsed_format == "npz" else ".csv")
+        files.append(file_n_summary)
+        stages.append(SummaryStage(file_n_summary, args.parsed_format, args.parsed_flush, crc_filter=args.crc != "off"))
+    if args.crc != "off" or args.summary:
+        stages.append(CrcStage(args.crc))
+    if args.keep_channels is not None or args.energy_min is not None or args.tot_window is not None:
+        stages.append(FilterStage(args.keep_channels, args.energy_min, args.tot_window))
+    if args.sort_window > 0:
+        stages.append(EventStage(args.sort_window / 1000))
+    if args.coinc_window > 0:
+        file_n_coinc = get_file_name(get_time(), name_file, "_coinc", ext="" if args.parsed_format == "npz" else ".csv")
+        files.append(file_n_coinc)
+        stages.append(CoincidenceStage(file_n_coinc, args.parsed_format, args.parsed_flush, args.coinc_window, args.coinc_multiplicity, args.coinc_channels))
+    if args.histograms:
+        file_n_histo = get_file_name(get_time(), name_file, "_histo", ext=".npz")
+        files.append(file_n_histo)
+        stages.append(HistogramStage(file_n_histo, histo_endpoint, args.histo_interval))
+    return stages, files
+
+
+def board_raw_output(args, board):
+    return raw_output(args, board_file_name(args.filename, board))
+
+
+def board_parsed_output(args, board):
+    # one histogram query socket per run, the boards only write snapshots
+    name_file = board_file_name(args.filename, board)
+    stages, _ = parse_stages(args, name_file, None)
+    return parsed_output(args, name_file) + (stages,)
+
+
+class BoardStream:
+    # raw output and counters of one connected board
+    def __init__(self, board, identity, file):
+        self.board = board
+        self.identity = identity
+        self.file = file
+        self.frames = 0
+        self.bytes = 0
+
+    def stats(self):
+        return {"identity": self.identity.hex(), "frames": self.frames, "bytes": self.bytes}
+
+
+def write_raw(ring, file, parts, t):
+    # t: receive time of the message, stamped in the capture frame headers
+    print("Message received")
+    for part in parts:
+        try:
+            file.write(part, t)
+        except Exception as e:
+            ring.count(RAW_WRITE_ERRORS)
+            print(f"It was not possible to write the data on the file: {e}")
 
 
-def string_no_space(string):
-    return string.replace(" ", "")
+def writer(filename, ring_name, raw_format="csv", overflow="block", policy=None, rates_endpoint=None, rates_interval=RATES_INTERVAL, rotate=None, rcvhwm=1000, perf_endpoint=None, boards=None, ingest="loop", raw_queue=RAW_QUEUE):
+    # boards(board) gives the raw output of each board, None mixes them all in filename
+    ring = ShmRing.attach(ring_name, overflow)
+    seq = 0
+    perf = Perf("writer")
+    perf_server = perf.install(perf_endpoint)
 
-def writer(filename, pipe_p):
     context = zmq.Context()
-    frontend = context.socket(zmq.ROUTER) 
+    if ingest == "asyncio":
+        frontend = zmq.asyncio.Context(context).socket(zmq.ROUTER)
+    else:
+        frontend = context.socket(zmq.ROUTER) 
+    # past the HWM the socket stops reading and TCP pushes back on the board
+    frontend.setsockopt(zmq.RCVHWM, rcvhwm)
     frontend.bind("tcp://*:5555")
+
+    streams = {}
+    def stats():
+        return dict(ring.stats(), boards={board: stream.stats() for board, stream in list(streams.items())})
+
+    rates = None
+    if rates_endpoint:
+        rates = RateCounter()
+        publisher = RatePublisher(rates, context, rates_endpoint, rates_interval, stats=stats if boards is not None else ring.stats)
+        publisher.start()
     
-    with open(filename, "w", newline="") as file:
-        writer = csv.DictWriter(file, fieldnames=["DMA data row"], dialect='excel')
-        writer.writeheader()
-        
-        try:
+    # the raw output thread of the asyncio ingest times nothing
+    if raw_format == "bin":
+        open_raw = functools.partial(CaptureWriter, policy=policy)
+    else:
+        open_raw = functools.partial(HexRowWriter, policy=policy, perf=perf if ingest == "loop" else None)
+    file = None
+    if boards is None:
+        file = rotate(open_raw) if rotate is not None else open_raw(filename)
+
+    def route(message):
+        # the raw output, board and data parts of a message
+        if boards is None:
+            return file, None, 0, [frame.buffer for frame in message if len(frame) != 1]
+        # the first part is the identity the ROUTER put in front
+        identity = message[0].bytes
+        board = board_index(identity)
+        stream = streams.get(board)
+        if stream is None:
+            board_file, board_rotate = boards(board)
+            stream = streams[board] = BoardStream(board, identity, board_rotate(open_raw) if board_rotate is not None else open_raw(board_file))
+            print(f"I: board {board} connected (identity {identity.hex()})")
+        return stream.file, stream, board, [frame.buffer for frame in message[1:] if len(frame) != 1]
+
+    def push(stream, board, parts, timing):
+        nonlocal seq
+        for part in parts:
+            if len(part) % 16:
+                ring.count(PARTIAL_FRAMES)
+            ring.push(part, seq, board=board)
+            seq += 1
+            if stream is not None:
+                stream.frames += 1
+                stream.bytes += len(part)
+        if timing:
+            perf.lap("ring_push")
+        if rates is not None:
+            for part in parts:
+                rates.add(part)
+            if timing:
+                perf.lap("rates")
+
+    async def receive_async(raw):
+        while True:
+            try:
+                timing = perf.frame()
+                if timing:
+                    await frontend.poll()
+                    perf.lap("wait")
+                message = await frontend.recv_multipart(copy=False)
+                t = time.time()
+                if timing:
+                    perf.lap("recv")
+                output, stream, board, parts = route(message)
+                raw.put(output, parts, t)
+                if timing:
+                    perf.lap("raw_queue")
+                push(stream, board, parts, timing)
+            except Exception as e:
+                print(f"It was not possible to receive data from the ADC: {e}")
+
+    raw = None
+    try:
+        if ingest == "asyncio":
+            # the loop only receives and fills the ring, the disk is on its own thread
+            raw = RawWriterThread(functools.partial(write_raw, ring), ring, raw_queue)
+            raw.start()
+            asyncio.run(receive_async(raw))
+        else:
             while True:
                 try:
-                    message = frontend.recv_multipart() 
-                    print("Message received")
-                    for part in message: 
-                        if len(part) != 1:
-                            l = int(len(part) / 2)
-                            v = struct.unpack_from(f"{l}H", part) 
-                            i = 0
-                            a = ""
-                            for b in v:
-                                value = f'{b:04x} ' 
-                                print(value, end='') 
-                                i += 1
-                                a += value
-                                if i % 8 == 0: 
-                                    try:
-                                        writer.writerow({"DMA data row": a.strip()})
-                                        file.flush()
-                                        pipe_p.send(a.strip())
-                                        a = ""
-                                        print("")
-                                        i = 0
-                                    except Exception as e:
-                                        print(f"It was not possible to write the data on the file: {e}")
+                    # zero-copy frames: the parts are only viewed, by the raw writer and the ring
+                    timing = perf.frame()
+                    if timing:
+                        frontend.poll()
+                        perf.lap("wait")
+                    message = frontend.recv_multipart(copy=False)
+                    t = time.time()
+                    if timing:
+                        perf.lap("recv")
+                    output, stream, board, parts = route(message)
+                    write_raw(ring, output, parts, t)
+                    if timing:
+                        perf.lap("raw_write")
+                    push(stream, board, parts, timing)
                 except Exception as e:
                     print(f"It was not possible to receive data from the ADC: {e}")
-            
-                                    
-    
-        except KeyboardInterrupt:
-            pass
-
-        finally:
-            frontend.close()
-            context.term()
-            file.close()
+        
+                                
 
+    except KeyboardInterrupt:
+        pass
 
-def parser(filename, pipe_c):
-    with open(filename, "w", newline="") as file_p:
-        writer_p = csv.DictWriter(file_p, fieldnames=["Channel", "Unix_time_16_bit", "Coarse_time", "TDC_time", "ToT_time", "TDC_trigger_end", "Energy", "CRC"], dialect="excel")
-        writer_p.writeheader()
-        while True:
+    finally:
+        ring.close_writer()
+        if raw is not None:
+            raw.stop()
+        if rates is not None:
+            publisher.stop()
+        if perf_server is not None:
+            perf_server.stop()
+        ring.close()
+        frontend.close()
+        context.term()
+        if file is not None:
+            file.close()
+        for board, stream in sorted(streams.items()):
+            stream.file.close()
+            print(f"I: writer board {board}: {stream.frames} frames, {stream.bytes} bytes")
+        perf.print()
+
+
+class Pipeline:
+    # parse stages and parsed output of one board, or of all of them
+    def __init__(self, out, stages):
+        self.out = out
+        self.stages = stages
+        self.frames = 0
+        self.hits = 0
+        for stage in stages:
+            stage.start()
+
+    def finish(self):
+        for hits in finish_stages(self.stages):
+            self.out.write(hits)
+
+    def close(self):
+        self.out.close()
+        for stage in self.stages:
+            stage.close()
+
+
+def parser(filename, ring_name, workers=1, parsed_format="csv", policy=None, stages=(), check_crc=False, index_every=0, rotate=None, perf_endpoint=None, boards=None):
+    # the writer closes the ring on Ctrl-C, the parser drains it and stops;
+    # boards(board) gives the output and stages of each board, None runs one
+    # pipeline for all of them. With check_crc the hits are decoded with a
+    # CRC_ok column, the stages check it.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ring = ShmRing.attach(ring_name)
+    perf = Perf("parser")
+    perf_server = perf.install(perf_endpoint)
+
+    def open_pipeline(filename, rotate, stages):
+        open_out = functools.partial(open_hit_writer, parsed_format=parsed_format, policy=policy,
+                                     dtype=output_dtype(stages, HIT_DTYPE_CRC if check_crc else HIT_DTYPE), index_every=index_every)
+        return Pipeline(rotate(open_out) if rotate is not None else open_out(filename), stages)
+
+    # the workers decode the frames of all the boards
+    if workers > 1:
+        pool = ParserPool(workers, check_crc=check_crc)
+        frames = pool.decode(ring)
+    else:
+        pool = None
+        frames = decode_frames(ring, check_crc, perf)
+
+    pipelines = {}
+    if boards is None:
+        pipelines[0] = open_pipeline(filename, rotate, stages)
+    try:
+        for seq, t, board, hits in frames:
+            # in-process decoding starts the frame itself, before the ring get
+            if pool is not None:
+                perf.frame()
+            if perf.timing:
+                perf.record("ring_latency", int((time.time() - t) * 1e9))
+            if len(hits) == 0:
+                ring.count(EMPTY_FRAMES)
+                print("E: nessun hit completo nel buffer, ignorando l'evento")
+                continue
+
+            pipeline = pipelines.get(board)
+            if pipeline is None:
+                pipeline = pipelines[board] = open_pipeline(*boards(board))
+
+            nhits = len(hits)
+            pipeline.frames += 1
+            pipeline.hits += nhits
             try:
-                event = pipe_c.recv()
-                if not event:
-                    print("E: evento vuoto ricevuto, interrompendo il parsing")
-                    continue
-
-                event = string_no_space(event)
-                event_cut = event[4:-4]
-
-                if not event_cut: 
-                    print("E: event_cut è vuoto, ignorando l'evento")
-                    continue 
-
+                hits = run_stages(pipeline.stages, hits, perf=perf)
+            except Exception as e:
+                ring.count(PARSE_ERRORS)
+                print(f"E: frame {seq} could not be processed, {nhits} hits lost: {e}")
+                ring.record_consumed(nhits, time.time() - t)
+                continue
 
-                number_bits = len(event_cut) * 4
-                event_integer = int(event_cut, 16)
+            try:
+                if len(hits):
+                    pipeline.out.write(hits)
 
-                binary_string = bin(event_integer)[2:]
-                event_bit = binary_string.zfill(number_bits)
-                
+            except Exception as e:
+                ring.count(PARSED_WRITE_ERRORS)
+                print(f"It was not possible to write  the data on the file: {e}")
+            if perf.timing:
+                perf.lap("write")
 
-                canale = int(event_bit[3:8],2)
-                tempo_16_bit = int(event_bit[8:24],2)
-                coarse_time = int(event_bit[24:32] + event_bit[33:40] + event_bit[40:53], 2)
-                tot = int(event_bit[53:59], 2)
-                tdc_trigger_end = int(event_bit[59:64], 2)
-                tdc_time = int(event_bit[69:74], 2)
-                energia = int(event_bit[74:88], 2)
-                crc = int(event_bit[88:96], 2)
+            ring.record_consumed(nhits, time.time() - t)
 
-                try:
-                    writer_p.writerow({
-                        "Channel": str(canale),
-                        "Unix_time_16_bit": str(tempo_16_bit),
-                        "Coarse_time": str(coarse_time),
-                        "TDC_time": str(tdc_time),
-                        "ToT_time": str(tot),
-                        "TDC_trigger_end": str(tdc_trigger_end),
-                        "Energy": str(energia),
-                        "CRC": str(crc)
-                    })
-
-                    file_p.flush() 
+        for pipeline in pipelines.values():
+            pipeline.finish()
+        
+    except Exception as e:
+        print(f"Something went wrong in the communication between the two processes : {e}")
 
-                except Exception as e:
-                    print(f"It was not possible to write  the data on the file: {e}")
-            
-            except Exception as e:
-                print(f"Something went wrong in the communication between the two processes : {e}")
+    finally:
+        for board, pipeline in sorted(pipelines.items()):
+            if boards is not None:
+                print(f"I: parser board {board}: {pipeline.hits} hits in {pipeline.frames} frames")
+            pipeline.close()
 
-        
+    if pool is not None:
+        pool.close()
+        pool.report()
+    if perf_server is not None:
+        perf_server.stop()
+    perf.print()
+    ring.close()
 
 
 if __name__ == "__main__":
 
     args = parse_args()
 
-    file_n = get_file_name(get_time(), args.filename)
-    check_file_exists(file_n)
-
-    file_n_parsed = get_file_name(get_time(), args.filename, "_parsed")
-    check_file_exists(file_n_parsed)
-    
-    parent_pipe, child_pipe = multiprocessing.Pipe()
-
-    writing = multiprocessing.Process(target=writer, args=(file_n, parent_pipe,))
-    parsing = multiprocessing.Process(target=parser, args=(file_n_parsed, child_pipe,))
+    if args.rotate is not None:
+        check_codec(args.compress)
+    if args.coinc_window > 0 and args.sort_window <= 0:
+        args.sort_window = SORT_WINDOW * 1000
+
+    file_n = file_n_parsed = rotate_raw = rotate_parsed = None
+    stages = []
+    raw_boards = parsed_boards = None
+    if args.per_board:
+        # the outputs are opened when each board first sends data
+        check_files_exist(glob.glob(board_file_name(glob.escape(args.filename), "*") + "_" + get_time() + "*"))
+        raw_boards = functools.partial(board_raw_output, args)
+        parsed_boards = functools.partial(board_parsed_output, args)
+    else:
+        # with --rotate these are the manifests listing the segments in order
+        file_n, rotate_raw = raw_output(args, args.filename)
+        file_n_parsed, rotate_parsed = parsed_output(args, args.filename)
+        stages, files = parse_stages(args, args.filename, args.histo_endpoint)
+        check_files_exist([file_n, file_n_parsed] + files)
+
+    ring = ShmRing.create(args.ring_size * 1024 * 1024, args.overflow)
+
+    writing = multiprocessing.Process(target=writer, kwargs=dict(
+        filename=file_n,
+        ring_name=ring.name,
+        raw_format=args.raw_format,
+        overflow=args.overflow,
+        policy=args.raw_flush,
+        rates_endpoint=args.rates_endpoint if args.rates else None,
+        rates_interval=args.rates_interval,
+        rotate=rotate_raw,
+        rcvhwm=args.rcvhwm,
+        perf_endpoint=process_endpoint(args.perf_endpoint, "writer"),
+        boards=raw_boards,
+        ingest=args.ingest,
+        raw_queue=args.raw_queue,
+    ))
+    parsing = multiprocessing.Process(target=parser, kwargs=dict(
+        filename=file_n_parsed,
+        ring_name=ring.name,
+        workers=args.workers,
+        parsed_format=args.parsed_format,
+        policy=args.parsed_flush,
+        stages=stages,
+        check_crc=args.crc != "off" or args.summary,
+        index_every=args.index_every if args.index else 0,
+        rotate=rotate_parsed,
+        perf_endpoint=process_endpoint(args.perf_endpoint, "parser"),
+        boards=parsed_boards,
+    ))
 
     try:
         writing.start()
         parsing.start()
+        # SIGUSR1 on the main process prints the timings of both
+        signal.signal(signal.SIGUSR1, lambda signum, frame: [os.kill(p.pid, signal.SIGUSR1) for p in (writing, parsing) if p.is_alive()])
 
-        writing.join() 
-        parsing.join()
+        try:
+            last, t = ring.stats(), time.time()
+            while writing.is_alive() or parsing.is_alive():
+                (writing if writing.is_alive() else parsing).join(args.status_interval or None)
+                if args.status_interval and time.time() - t >= args.status_interval:
+                    stats, now = ring.stats(), time.time()
+                    print(status_line(stats, last, now - t))
+                    last, t = stats, now
+        except KeyboardInterrupt:
+            # let the parser drain what the writer already queued
+            writing.join()
+            parsing.join()
     
     finally:
         if writing.is_alive():
@@ -171,4 +558,15 @@ if __name__ == "__main__":
         if parsing.is_alive():
             parsing.terminate()
 
+        stats = ring.stats()
+        print(f"I: ring buffer high-water mark {stats['high_water_mark']}/{stats['capacity']} bytes, dropped {stats['dropped_frames']} frames ({stats['dropped_bytes']} bytes)")
+        print(f"I: writer blocked {stats['blocked_us'] / 1e6:.2f} s on a full ring, {stats['partial_frames']} partial frames, {stats['raw_write_errors']} raw write errors; "
+              f"parser {stats['empty_frames']} empty frames, {stats['parse_errors']} parse errors, {stats['parsed_write_errors']} parsed write errors")
+        if stats['raw_queue_full']:
+            print(f"I: receive held back {stats['raw_queue_full']} times ({stats['raw_queue_wait_us'] / 1e6:.2f} s) by a full raw output queue")
+        if stats['frames_parsed']:
+            print(f"I: parsed {stats['hits_parsed']} hits in {stats['frames_parsed']} frames, writer to parser latency mean {stats['latency_sum_us'] / stats['frames_parsed'] / 1000:.2f} ms max {stats['latency_max_us'] / 1000:.2f} ms")
+        ring.close()
+        ring.unlink()
+
     print("Both processes finished.")
@@ -0,0 +1,116 @@
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from adc_ring import ShmRing
+from adc_simulator import DEFAULT_SIM_CHANNELS, HitGenerator, parse_channel_mix, simulate
+from ADC_parsing import parser, writer
+
+# End-to-end benchmark: runs the writer and parser stages of ADC_parsing on
+# a temporary directory and feeds them from the synthetic hit source at
+# increasing rates. For every step it reports the achieved send rate, the
+# hits lost (not parsed) and the writer to parser latency.
+
+DRAIN_TIMEOUT = 30
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="end-to-end ADC_parsing throughput benchmark")
+    parser.add_argument('--rates', action='store', type=str, help='comma-separated hit rates to test (default: doubling from 10000 to 2560000)', default=",".join(str(10000 * 2 ** i) for i in range(9)))
+    parser.add_argument('--step-duration', action='store', type=float, help='seconds per rate step (default: 5)', default=5)
+    parser.add_argument('--channels', action='store', type=str, help='channel mix (default: all 7 channels)', default=",".join(str(c) for c in range(DEFAULT_SIM_CHANNELS)))
+    parser.add_argument('--burst', action='store', type=int, help='hits per burst (default: 1000)', default=1000)
+    parser.add_argument('--frame', action='store', type=int, help='hits per ZMQ frame (default: 100)', default=100)
+    parser.add_argument('--crc-error', action='store', type=float, help='fraction of hits with CRC errors (default: 0)', default=0.0)
+    parser.add_argument('--raw-format', action='store', choices=['csv', 'bin'], help='raw capture format (default: bin)', default="bin")
+    parser.add_argument('--parsed-format', action='store', choices=['csv', 'npz'], help='parsed hits format (default: csv)', default="csv")
+    parser.add_argument('-j', '--workers', action='store', type=int, help='number of parser worker processes (default: 1)', default=1)
+    parser.add_argument('--ring-size', action='store', type=int, help='ring buffer size in MB (default: 64)', default=64)
+    parser.add_argument('--max-loss', action='store', type=float, help='loss fraction still counted as sustained (default: 0)', default=0.0)
+    parser.add_argument('--max-drain', action='store', type=float, help='seconds the parser may lag behind after a step and still count as sustained (default: 1)', default=1.0)
+    parser.add_argument('--outdir', action='store', type=str, help='directory for the output files (default: a temporary directory)')
+    return parser.parse_args()
+
+
+def quiet(target, **kwargs):
+    # the stages print every received message, keep the benchmark output readable
+    sys.stdout = open(os.devnull, "w")
+    target(**kwargs)
+
+
+def wait_drained(ring, timeout=DRAIN_TIMEOUT):
+    start = time.perf_counter()
+    last = -1
+    while time.perf_counter() - start < timeout:
+        stats = ring.stats()
+        if stats["used"] == 0 and stats["hits_parsed"] == last:
+            break
+        last = stats["hits_parsed"]
+        time.sleep(0.2)
+    return time.perf_counter() - start
+
+
+def run_step(ring, generator, rate, args):
+    ring.reset_latency_max()
+    before = ring.stats()
+    count = int(rate * args.step_duration)
+    sent, elapsed = simulate("tcp://localhost:5555", generator, rate, count, args.burst, args.frame)
+    drain = wait_drained(ring)
+    after = ring.stats()
+
+    parsed = after["hits_parsed"] - before["hits_parsed"]
+    frames = after["frames_parsed"] - before["frames_parsed"]
+    latency = (after["latency_sum_us"] - before["latency_sum_us"]) / frames / 1000 if frames else 0
+    return {
+        "rate": rate,
+        "sent_rate": sent / elapsed,
+        "loss": 1 - parsed / sent if sent else 0,
+        "ring_drops": after["dropped_frames"] - before["dropped_frames"],
+        "latency_mean_ms": latency,
+        "latency_max_ms": after["latency_max_us"] / 1000,
+        "drain_s": drain,
+    }
+
+
+def benchmark(args):
+    outdir = args.outdir or tempfile.mkdtemp(prefix="adc_benchmark_")
+    raw_ext = ".bin" if args.raw_format == "bin" else ".csv"
+    parsed_ext = "" if args.parsed_format == "npz" else ".csv"
+    ring = ShmRing.create(args.ring_size * 1024 * 1024, "drop")
+
+    writing = multiprocessing.Process(target=quiet, args=(writer,), kwargs=dict(
+        filename=os.path.join(outdir, "bench" + raw_ext), ring_name=ring.name, raw_format=args.raw_format, overflow="drop"))
+    parsing = multiprocessing.Process(target=quiet, args=(parser,), kwargs=dict(
+        filename=os.path.join(outdir, "bench_parsed" + parsed_ext), ring_name=ring.name, workers=args.workers, parsed_format=args.parsed_format))
+    writing.start()
+    parsing.start()
+
+    channels, weights = parse_channel_mix(args.channels)
+    generator = HitGenerator(channels, weights, args.crc_error)
+    sustained = 0
+    print(f"I: writing to {outdir}")
+    print(f"{'rate':>10} {'sent/s':>10} {'loss':>8} {'ring drops':>10} {'lat mean':>9} {'lat max':>9} {'drain':>6}")
+    try:
+        for rate in [float(r) for r in args.rates.split(",")]:
+            r = run_step(ring, generator, rate, args)
+            print(f"{r['rate']:>10.0f} {r['sent_rate']:>10.0f} {r['loss']:>8.2%} {r['ring_drops']:>10} {r['latency_mean_ms']:>7.2f}ms {r['latency_max_ms']:>7.2f}ms {r['drain_s']:>5.1f}s")
+            if r["loss"] > args.max_loss or r["sent_rate"] < 0.95 * rate or r["drain_s"] > args.max_drain:
+                break
+            sustained = rate
+    finally:
+        os.kill(writing.pid, signal.SIGINT)
+        writing.join()
+        parsing.join()
+        ring.close()
+        ring.unlink()
+
+    print(f"I: maximum sustained hit rate {sustained:.0f} hits/s")
+    return sustained
+
+
+if __name__ == "__main__":
+    benchmark(parse_args())
@@ -0,0 +1,109 @@
+import argparse
+import csv
+import mmap
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from adc_decode import HIT_WORDS, words_from_buffer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from buffered_output import BufferedOutput
+
+# Binary raw capture: the magic string followed by one record per received
+# ZMQ part. Each record is a frame header (sequence number, receive time,
+# payload length) and the payload as received, padded to 8 bytes so that
+# every payload can be viewed in place as an array of 16-bit words.
+
+CAPTURE_MAGIC = b"MPMTRAW1"
+# seq, t, length, board: the board index is only used in the ring buffer,
+# a capture holds one board and keeps it 0
+FRAME_HEADER = struct.Struct("<QdII")
+FRAME_ALIGN = 8
+
+
+def padded_length(n):
+    return (n + FRAME_ALIGN - 1) // FRAME_ALIGN * FRAME_ALIGN
+
+
+class CaptureWriter:
+    def __init__(self, filename, policy=None):
+        self.file = BufferedOutput(filename, policy, binary=True)
+        self.file.write(CAPTURE_MAGIC)
+        self.seq = 0
+
+    def write(self, part, t=None):
+        if t is None:
+            t = time.time()
+        n = len(part)
+        self.file.write(FRAME_HEADER.pack(self.seq, t, n, 0))
+        self.file.write(part)
+        self.file.write(bytes(padded_length(n) - n))
+        self.file.commit()
+        self.seq += 1
+
+    @property
+    def bytes_written(self):
+        return self.file.bytes_written
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def open_capture(filename):
+    with open(filename, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+        mm.close()
+        raise ValueError(f"E: {filename} is not a binary raw capture")
+    return mm
+
+
+def iter_frames(mm):
+    off = len(CAPTURE_MAGIC)
+    while off + FRAME_HEADER.size <= len(mm):
+        seq, t, n, _ = FRAME_HEADER.unpack_from(mm, off)
+        off += FRAME_HEADER.size
+        if off + n > len(mm):
+            # last record still being written
+            break
+        yield seq, t, np.frombuffer(mm, dtype=np.uint8, count=n, offset=off)
+        off += padded_length(n)
+
+
+def capture_to_csv(capture_name, csv_name):
+    mm = open_capture(capture_name)
+    rows = 0
+    with open(csv_name, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=["DMA data row"], dialect='excel')
+        writer.writeheader()
+        for _, _, payload in iter_frames(mm):
+            words = words_from_buffer(payload)
+            text = words.astype(">u2").tobytes().hex()
+            for i in range(0, len(text), HIT_WORDS * 4):
+                row = text[i:i + HIT_WORDS * 4]
+                writer.writerow({"DMA data row": " ".join(row[j:j + 4] for j in range(0, len(row), 4))})
+                rows += 1
+    return rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="convert a binary raw capture to the legacy hex CSV")
+    parser.add_argument('capture', action='store', type=str, help='binary raw capture file')
+    parser.add_argument('-o', '--output', action='store', type=str, help='output CSV filename (default: capture name with .csv)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    out = args.output
+    if out is None:
+        out = args.capture.rsplit(".", 1)[0] + ".csv"
+    n = capture_to_csv(args.capture, out)
+    print(f"I: {n} rows written to {out}")
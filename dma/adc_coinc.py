@@ -0,0 +1,111 @@
+import numpy as np
+
+from adc_decode import CRC_FIELD, channel_mask
+from adc_events import TICKS_PER_SECOND, TIMESTAMP_FIELD
+from adc_output import open_hit_writer
+from adc_stages import ParseStage
+
+# Coincidence finder on the time-sorted hit stream of the event builder. A
+# group opens at a hit and takes every hit up to one window later; it is
+# kept when at least `multiplicity` different channels of the mask are in
+# it, and the next group may only open after its window. Channel counts in
+# a window come from per-channel cumulative sums, so the cost is linear in
+# the number of hits. Hits are passed on unchanged, the groups are written
+# to their own file.
+
+COINC_WINDOW = 100  # ns
+COINC_MULTIPLICITY = 2
+
+GROUP_DTYPE = np.dtype([
+    ("Timestamp", np.uint64),
+    ("Duration", np.uint32),
+    ("Multiplicity", np.uint8),
+    ("Hits", np.uint16),
+    ("Channel_mask", np.uint32),
+    ("Energy_sum", np.uint32),
+])
+
+
+class CoincidenceFinder:
+    def __init__(self, window=COINC_WINDOW, multiplicity=COINC_MULTIPLICITY, channels=None):
+        self.window = np.uint64(round(window * TICKS_PER_SECOND / 1e9))
+        self.multiplicity = multiplicity
+        self.mask = channel_mask(channels) if channels is not None else 0xFFFFFFFF
+        self.pending = None
+        self.busy_until = None
+        self.groups = 0
+
+    def push(self, hits, final=False):
+        keep = (np.left_shift(np.uint32(1), hits["Channel"].astype(np.uint32)) & np.uint32(self.mask)) != 0
+        if CRC_FIELD in hits.dtype.names:
+            keep &= hits[CRC_FIELD] == 1
+        h = hits[keep] if self.pending is None else np.concatenate((self.pending, hits[keep]))
+        if len(h) == 0:
+            self.pending = h
+            return np.empty(0, dtype=GROUP_DTYPE)
+
+        ts = h[TIMESTAMP_FIELD]
+        # only windows that end before the newest hit are complete
+        complete = len(h) if final else np.searchsorted(ts, ts[-1] - self.window, side="left")
+        start = np.arange(complete)
+        end = np.searchsorted(ts, ts[:complete] + self.window, side="right")
+        ch = h["Channel"]
+        distinct = np.zeros(complete, dtype=np.int32)
+        for c in np.unique(ch):
+            cum = np.concatenate(([0], np.cumsum(ch == c)))
+            distinct += cum[end] > cum[start]
+
+        groups = []
+        for i in np.flatnonzero(distinct >= self.multiplicity):
+            if self.busy_until is not None and ts[i] <= self.busy_until:
+                continue
+            g = h[i:end[i]]
+            groups.append((ts[i], ts[end[i] - 1] - ts[i], distinct[i], len(g),
+                           np.bitwise_or.reduce(np.left_shift(np.uint32(1), g["Channel"].astype(np.uint32))),
+                           g["Energy"].sum()))
+            self.busy_until = ts[i] + self.window
+        self.pending = h[complete:]
+        self.groups += len(groups)
+        return np.array(groups, dtype=GROUP_DTYPE)
+
+    def flush(self):
+        if self.pending is None:
+            return np.empty(0, dtype=GROUP_DTYPE)
+        return self.push(self.pending[:0], final=True)
+
+
+class CoincidenceStage(ParseStage):
+    def __init__(self, filename, parsed_format="csv", policy=None, window=COINC_WINDOW, multiplicity=COINC_MULTIPLICITY, channels=None):
+        self.filename = filename
+        self.parsed_format = parsed_format
+        self.policy = policy
+        self.window = window
+        self.multiplicity = multiplicity
+        self.channels = channels
+        self.finder = None
+        self.out = None
+
+    def output_dtype(self, dtype):
+        if TIMESTAMP_FIELD not in dtype.names:
+            raise ValueError("the coincidence stage needs the time-sorted hits of the event builder")
+        return dtype
+
+    def start(self):
+        self.finder = CoincidenceFinder(self.window, self.multiplicity, self.channels)
+        self.out = open_hit_writer(self.filename, self.parsed_format, self.policy, GROUP_DTYPE)
+
+    def process(self, hits):
+        groups = self.finder.push(hits)
+        if len(groups):
+            self.out.write(groups)
+        return hits
+
+    def finish(self):
+        groups = self.finder.flush()
+        if len(groups):
+            self.out.write(groups)
+        return None
+
+    def close(self):
+        self.out.close()
+        print(f"I: coincidences: {self.finder.groups} groups of at least {self.multiplicity} channels within {self.window:g} ns")
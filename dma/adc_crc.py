@@ -0,0 +1,45 @@
+import numpy as np
+
+from adc_decode import CHANNELS, CRC_FIELD
+from adc_stages import ParseStage
+
+CRC_MODES = ["off", "tag", "drop"]
+
+
+# parse stage: counts good and bad CRCs per channel on hits decoded with
+# check_crc, then either keeps the CRC_ok column (tag) or removes the bad
+# hits and the column (drop). With off the hits were only decoded with the
+# column for the summary: it is removed and every hit is kept.
+class CrcStage(ParseStage):
+    def __init__(self, mode="tag"):
+        self.mode = mode
+        self.good = np.zeros(CHANNELS, dtype=np.uint64)
+        self.bad = np.zeros(CHANNELS, dtype=np.uint64)
+
+    def output_dtype(self, dtype):
+        if self.mode != "tag":
+            return np.dtype([(field, dtype[field]) for field in dtype.names if field != CRC_FIELD])
+        return dtype
+
+    def process(self, hits):
+        if self.mode == "off":
+            return strip_crc(hits, self.output_dtype(hits.dtype))
+        ok = hits[CRC_FIELD].astype(bool)
+        ch = hits["Channel"]
+        self.good += np.bincount(ch[ok], minlength=CHANNELS).astype(np.uint64)
+        self.bad += np.bincount(ch[~ok], minlength=CHANNELS).astype(np.uint64)
+        if self.mode == "drop":
+            return strip_crc(hits[ok], self.output_dtype(hits.dtype))
+        return hits
+
+    def close(self):
+        for ch in np.flatnonzero(self.good + self.bad):
+            good, bad = int(self.good[ch]), int(self.bad[ch])
+            print(f"I: CRC channel {ch}: {good} good, {bad} bad ({bad / (good + bad):.3%})")
+
+
+def strip_crc(hits, dtype):
+    out = np.empty(len(hits), dtype=dtype)
+    for field in dtype.names:
+        out[field] = hits[field]
+    return out
@@ -0,0 +1,136 @@
+import numpy as np
+
+# Every hit is transferred as 8 16-bit words. The first and the last word are
+# framing, the 96-bit hit word sits in words 1..6 (MSB first):
+#
+#   bits  3..7   channel
+#   bits  8..23  unix time (16 bit)
+#   bits 24..31  coarse time [27:20]   (bit 32 is not part of the coarse time)
+#   bits 33..52  coarse time [19:0]
+#   bits 53..58  ToT
+#   bits 59..63  TDC trigger end
+#   bits 69..73  TDC time
+#   bits 74..87  energy
+#   bits 88..95  CRC
+
+HIT_WORDS = 8
+
+# the channel field is 5 bits wide
+CHANNELS = 1 << 5
+
+# The coarse time counts clock ticks within the second given by the unix
+# time, the TDC time splits a coarse tick in 32 bins.
+COARSE_HZ = 125000000
+TDC_BINS = 32
+
+FIELDS = ["Channel", "Unix_time_16_bit", "Coarse_time", "TDC_time", "ToT_time", "TDC_trigger_end", "Energy", "CRC"]
+
+HIT_DTYPE = np.dtype([
+    ("Channel", np.uint8),
+    ("Unix_time_16_bit", np.uint16),
+    ("Coarse_time", np.uint32),
+    ("TDC_time", np.uint8),
+    ("ToT_time", np.uint8),
+    ("TDC_trigger_end", np.uint8),
+    ("Energy", np.uint16),
+    ("CRC", np.uint8),
+])
+
+# with CRC checking the decoder adds a 1/0 column telling whether the CRC matched
+CRC_FIELD = "CRC_ok"
+HIT_DTYPE_CRC = np.dtype(HIT_DTYPE.descr + [(CRC_FIELD, np.uint8)])
+
+
+# CRC-8 over the 88 bits preceding the CRC field, MSB first
+CRC_POLY = 0x07
+CRC_INIT = 0x00
+
+
+def crc8_table(poly=CRC_POLY):
+    table = np.zeros(256, dtype=np.uint8)
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = ((c << 1) ^ poly) if c & 0x80 else (c << 1)
+        table[i] = c & 0xFF
+    return table
+
+
+CRC_TABLE = crc8_table()
+
+
+def parse_channels(text):
+    # "0,1,2", "0-6" or a mix of both
+    channels = set()
+    for item in text.split(","):
+        lo, _, hi = item.partition("-")
+        channels.update(range(int(lo), int(hi or lo) + 1))
+    return sorted(channels)
+
+
+def channel_mask(channels):
+    mask = 0
+    for ch in channels:
+        mask |= 1 << ch
+    return mask
+
+
+def words_from_buffer(buf):
+    # native byte order, same as struct.unpack_from("H") in the writer
+    n = (len(buf) // 2) // HIT_WORDS * HIT_WORDS
+    return np.frombuffer(buf, dtype=np.uint16, count=n).reshape(-1, HIT_WORDS)
+
+
+def words_from_rows(rows):
+    # rows as written in the raw CSV: "wwww wwww wwww wwww wwww wwww wwww wwww"
+    words = np.frombuffer(bytes.fromhex(" ".join(rows)), dtype=">u2").astype(np.uint16)
+    n = len(words) // HIT_WORDS * HIT_WORDS
+    return words[:n].reshape(-1, HIT_WORDS)
+
+
+def decode_words(words, check_crc=False):
+    w = words.astype(np.uint32)
+    w1, w2, w3, w4, w5, w6 = w[:, 1], w[:, 2], w[:, 3], w[:, 4], w[:, 5], w[:, 6]
+
+    hits = np.empty(len(w), dtype=HIT_DTYPE_CRC if check_crc else HIT_DTYPE)
+    hits["Channel"] = (w1 >> 8) & (CHANNELS - 1)
+    hits["Unix_time_16_bit"] = ((w1 & 0xFF) << 8) | (w2 >> 8)
+    hits["Coarse_time"] = ((w2 & 0xFF) << 20) | ((w3 & 0x7FFF) << 5) | (w4 >> 11)
+    hits["TDC_time"] = (w5 >> 6) & 0x1F
+    hits["ToT_time"] = (w4 >> 5) & 0x3F
+    hits["TDC_trigger_end"] = w4 & 0x1F
+    hits["Energy"] = ((w5 & 0x3F) << 8) | (w6 >> 8)
+    hits["CRC"] = w6 & 0xFF
+    if check_crc:
+        hits[CRC_FIELD] = crc8_words(words) == hits["CRC"]
+    return hits
+
+
+def crc8_words(words):
+    data = words[:, 1:7].astype(">u2").view(np.uint8)[:, :11]
+    crc = np.full(len(words), CRC_INIT, dtype=np.uint8)
+    for k in range(data.shape[1]):
+        crc = CRC_TABLE[crc ^ data[:, k]]
+    return crc
+
+
+def encode_hits(hits, crc=True):
+    # inverse of decode_words, framing words and unused bits are left at 0
+    h = {field: hits[field].astype(np.uint32) for field in FIELDS}
+    words = np.zeros((len(hits), HIT_WORDS), dtype=np.uint16)
+    words[:, 1] = (h["Channel"] << 8) | (h["Unix_time_16_bit"] >> 8)
+    words[:, 2] = ((h["Unix_time_16_bit"] & 0xFF) << 8) | (h["Coarse_time"] >> 20)
+    words[:, 3] = (h["Coarse_time"] >> 5) & 0x7FFF
+    words[:, 4] = ((h["Coarse_time"] & 0x1F) << 11) | (h["ToT_time"] << 5) | h["TDC_trigger_end"]
+    words[:, 5] = (h["TDC_time"] << 6) | (h["Energy"] >> 8)
+    words[:, 6] = (h["Energy"] & 0xFF) << 8
+    words[:, 6] |= crc8_words(words) if crc else h["CRC"]
+    return words
+
+
+def decode_buffer(buf, check_crc=False):
+    return decode_words(words_from_buffer(buf), check_crc)
+
+
+def decode_rows(rows, check_crc=False):
+    return decode_words(words_from_rows(rows), check_crc)
@@ -0,0 +1,119 @@
+import time
+
+import numpy as np
+
+from adc_decode import COARSE_HZ, CRC_FIELD, TDC_BINS
+from adc_stages import ParseStage
+
+# Event building: every hit gets an absolute 64-bit time stamp and the
+# per-channel streams, each in time order but interleaved in arrival order,
+# are merged into one time-sorted stream. Hits are held back for a bounded
+# reordering window, so the sorted stream is written as the run goes.
+
+TIMESTAMP_FIELD = "Timestamp"
+TICKS_PER_SECOND = COARSE_HZ * TDC_BINS  # time stamp unit: one TDC bin
+SORT_WINDOW = 0.01
+
+
+def timestamp_dtype(dtype):
+    return np.dtype(dtype.descr + [(TIMESTAMP_FIELD, np.uint64)])
+
+
+class UnixTimeUnwrapper:
+    # The 16-bit unix time wraps every 65536 s. Each batch is unwrapped
+    # against a reference second taken from the previous one, much closer
+    # than half the wrap period, so a corrupted hit only spoils its own time.
+    # The first batch is anchored on the second nearest to the wall clock
+    # (or a given anchor time) with the same low bits, so a board clock a
+    # little ahead of or behind the host still lands on the right day.
+    def __init__(self, anchor=None):
+        self.anchor = anchor
+        self.ref = None
+
+    def unwrap(self, unix16):
+        u = unix16.astype(np.int64)
+        if self.ref is None:
+            now = int(time.time() if self.anchor is None else self.anchor)
+            u0 = int(np.median(u))
+            self.ref = now + (((u0 - now + 0x8000) & 0xFFFF) - 0x8000)
+        d = ((u - self.ref + 0x8000) & 0xFFFF) - 0x8000
+        full = self.ref + d
+        self.ref = int(np.median(full))
+        return full
+
+
+def timestamps(hits, unix_seconds):
+    ts = unix_seconds.astype(np.uint64) * np.uint64(COARSE_HZ) + hits["Coarse_time"]
+    return ts * np.uint64(TDC_BINS) + hits["TDC_time"]
+
+
+class EventBuilder:
+    def __init__(self, window=SORT_WINDOW, anchor=None):
+        self.window = np.uint64(window * TICKS_PER_SECOND)
+        self.unwrapper = UnixTimeUnwrapper(anchor)
+        self.pending = None
+        self.newest = np.uint64(0)
+        self.released = 0
+        self.last_released = np.uint64(0)
+        self.late = 0
+
+    def push(self, hits):
+        if len(hits) == 0:
+            return np.empty(0, dtype=timestamp_dtype(hits.dtype))
+        out = np.empty(len(hits), dtype=timestamp_dtype(hits.dtype))
+        for field in hits.dtype.names:
+            out[field] = hits[field]
+        out[TIMESTAMP_FIELD] = timestamps(hits, self.unwrapper.unwrap(hits["Unix_time_16_bit"]))
+        self.pending = out if self.pending is None else np.concatenate((self.pending, out))
+
+        # the window follows the median of the batch: a corrupted hit may
+        # carry any time and must not flush the pending hits ahead of it
+        ts = out[TIMESTAMP_FIELD]
+        if CRC_FIELD in out.dtype.names:
+            ts = ts[out[CRC_FIELD] == 1]
+        if len(ts):
+            self.newest = max(self.newest, np.partition(ts, len(ts) // 2)[len(ts) // 2])
+        if self.newest <= self.window:
+            return out[:0]
+        return self.release(self.newest - self.window)
+
+    def release(self, watermark):
+        if self.pending is None:
+            return None
+        # the sorted remainder plus the new batch, itself a few sorted runs
+        # (one per channel): a stable sort merges them in close to linear time
+        pending = self.pending[np.argsort(self.pending[TIMESTAMP_FIELD], kind="stable")]
+        n = np.searchsorted(pending[TIMESTAMP_FIELD], watermark, side="right")
+        out, self.pending = pending[:n], pending[n:]
+        if n:
+            # hits that arrived after newer ones were already written
+            self.late += int(np.count_nonzero(out[TIMESTAMP_FIELD] < self.last_released))
+            self.last_released = max(self.last_released, out[TIMESTAMP_FIELD][-1])
+            self.released += n
+        return out
+
+    def flush(self):
+        return self.release(np.iinfo(np.uint64).max)
+
+
+class EventStage(ParseStage):
+    def __init__(self, window=SORT_WINDOW, anchor=None):
+        self.window = window
+        self.anchor = anchor
+        self.builder = None
+
+    def output_dtype(self, dtype):
+        return timestamp_dtype(dtype)
+
+    def start(self):
+        self.builder = EventBuilder(self.window, self.anchor)
+
+    def process(self, hits):
+        return self.builder.push(hits)
+
+    def finish(self):
+        return self.builder.flush()
+
+    def close(self):
+        b = self.builder
+        print(f"I: event builder: {b.released} hits time-sorted with a {self.window * 1000:g} ms window, {b.late} arrived too late and are out of order")
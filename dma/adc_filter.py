@@ -0,0 +1,71 @@
+import numpy as np
+
+from adc_decode import CHANNELS
+from adc_stages import ParseStage
+
+REASONS = ["channel", "energy", "tot"]
+
+
+def parse_thresholds(text):
+    # "100" for every channel, "0=120,3=90" per channel or "100,3=250"
+    thresholds = np.zeros(CHANNELS, dtype=np.int64)
+    items = [item.partition("=") for item in text.split(",")]
+    for value, sep, _ in items:
+        if not sep:
+            thresholds[:] = int(value)
+    for ch, sep, value in items:
+        if sep:
+            thresholds[int(ch)] = int(value)
+    return thresholds
+
+
+def parse_window(text):
+    # "lo-hi", both included
+    lo, _, hi = text.partition("-")
+    return int(lo), int(hi)
+
+
+# parse stage: keeps only the hits of the selected channels, at or above the
+# energy threshold of their channel and with a ToT inside the window, counting
+# the rejected hits per channel and per reason (the first one that applies)
+class FilterStage(ParseStage):
+    def __init__(self, channels=None, energy_min=None, tot_window=None):
+        self.allowed = np.zeros(CHANNELS, dtype=bool)
+        self.allowed[channels if channels is not None else slice(None)] = True
+        self.energy_min = energy_min
+        self.tot_window = tot_window
+        self.accepted = np.zeros(CHANNELS, dtype=np.uint64)
+        self.rejected = {reason: np.zeros(CHANNELS, dtype=np.uint64) for reason in REASONS}
+
+    def reject(self, reason, ch):
+        if len(ch):
+            self.rejected[reason] += np.bincount(ch, minlength=CHANNELS).astype(np.uint64)
+
+    def process(self, hits):
+        ch = hits["Channel"].astype(np.intp)
+        keep = self.allowed[ch]
+        self.reject("channel", ch[~keep])
+        if self.energy_min is not None:
+            ok = hits["Energy"] >= self.energy_min[ch]
+            self.reject("energy", ch[keep & ~ok])
+            keep &= ok
+        if self.tot_window is not None:
+            lo, hi = self.tot_window
+            tot = hits["ToT_time"]
+            ok = (tot >= lo) & (tot <= hi)
+            self.reject("tot", ch[keep & ~ok])
+            keep &= ok
+        self.accepted += np.bincount(ch[keep], minlength=CHANNELS).astype(np.uint64)
+        if keep.all():
+            return hits
+        return hits[keep]
+
+    def close(self):
+        accepted = int(self.accepted.sum())
+        rejected = {reason: int(counts.sum()) for reason, counts in self.rejected.items()}
+        total = accepted + sum(rejected.values())
+        print(f"I: filter: {accepted} of {total} hits accepted, rejected {rejected['channel']} by channel, "
+              f"{rejected['energy']} below the energy threshold, {rejected['tot']} outside the ToT window")
+        for ch in np.flatnonzero(sum(self.rejected.values())):
+            counts = ", ".join(f"{int(self.rejected[reason][ch])} {reason}" for reason in REASONS if self.rejected[reason][ch])
+            print(f"I: filter channel {ch}: {int(self.accepted[ch])} accepted, rejected {counts}")
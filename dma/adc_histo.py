@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import zmq
+
+from adc_decode import CHANNELS
+from adc_stages import ParseStage
+
+# Online per-channel histograms. Every decoded batch is added in place with
+# one bincount per field. The counts are snapshotted to a .npz file at a
+# fixed cadence and can be queried during the run over a local REP socket.
+
+# field: (low edge, high edge, number of bins)
+HISTO_FIELDS = {
+    "Energy": (0, 1 << 14, 1024),
+    "ToT_time": (0, 64, 64),
+    "TDC_time": (0, 32, 32),
+}
+
+HISTO_ENDPOINT = "tcp://127.0.0.1:5556"
+SNAPSHOT_INTERVAL = 10
+
+
+class ChannelHistograms:
+    def __init__(self, fields=HISTO_FIELDS, channels=CHANNELS):
+        self.fields = fields
+        self.channels = channels
+        self.counts = {field: np.zeros((channels, nbins), dtype=np.uint64) for field, (_, _, nbins) in fields.items()}
+
+    def update(self, hits):
+        ch = hits["Channel"].astype(np.intp)
+        for field, (lo, hi, nbins) in self.fields.items():
+            b = (hits[field].astype(np.intp) - lo) * nbins // (hi - lo)
+            np.clip(b, 0, nbins - 1, out=b)
+            self.counts[field] += np.bincount(ch * nbins + b, minlength=self.channels * nbins).astype(np.uint64).reshape(self.channels, nbins)
+
+    def edges(self, field):
+        lo, hi, nbins = self.fields[field]
+        return np.linspace(lo, hi, nbins + 1)
+
+    def snapshot(self, filename):
+        # written next to the target and renamed, readers never see a partial file
+        tmp = filename + ".tmp.npz"
+        np.savez(tmp, time=time.time(), **self.counts)
+        os.replace(tmp, filename)
+
+    def query(self, request):
+        field = request.get("field", "Energy")
+        if field not in self.counts:
+            return {"error": f"unknown field {field}", "fields": list(self.counts)}
+        counts = self.counts[field]
+        channel = request.get("channel")
+        if channel is not None:
+            counts = counts[int(channel)]
+        return {"field": field, "channel": channel, "edges": self.edges(field).tolist(), "counts": counts.tolist()}
+
+
+class HistogramServer(threading.Thread):
+    def __init__(self, histos, endpoint=HISTO_ENDPOINT):
+        super().__init__(daemon=True)
+        self.histos = histos
+        self.endpoint = endpoint
+        self.running = True
+
+    def run(self):
+        context = zmq.Context.instance()
+        socket = context.socket(zmq.REP)
+        socket.bind(self.endpoint)
+        try:
+            while self.running:
+                if socket.poll(200):
+                    try:
+                        request = json.loads(socket.recv())
+                        reply = self.histos.query(request)
+                    except Exception as e:
+                        reply = {"error": str(e)}
+                    socket.send(json.dumps(reply).encode())
+        finally:
+            socket.close(linger=0)
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+
+class HistogramStage(ParseStage):
+    def __init__(self, snapshot_file, endpoint=HISTO_ENDPOINT, interval=SNAPSHOT_INTERVAL):
+        self.snapshot_file = snapshot_file
+        self.endpoint = endpoint
+        self.interval = interval
+        self.histos = None
+        self.server = None
+
+    def start(self):
+        self.histos = ChannelHistograms()
+        if self.endpoint:
+            self.server = HistogramServer(self.histos, self.endpoint)
+            self.server.start()
+        self.last_snapshot = time.time()
+
+    def process(self, hits):
+        self.histos.update(hits)
+        if self.interval and time.time() - self.last_snapshot >= self.interval:
+            self.histos.snapshot(self.snapshot_file)
+            self.last_snapshot = time.time()
+        return hits
+
+    def close(self):
+        self.histos.snapshot(self.snapshot_file)
+        if self.server is not None:
+            self.server.stop()
+
+
+def query(endpoint, field, channel=None, timeout=2000):
+    context = zmq.Context.instance()
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.RCVTIMEO, timeout)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(endpoint)
+    try:
+        socket.send(json.dumps({"field": field, "channel": channel}).encode())
+        return json.loads(socket.recv())
+    finally:
+        socket.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="print a per-channel histogram from a running parser or a snapshot file")
+    parser.add_argument('--endpoint', action='store', type=str, help=f'parser histogram endpoint (default: {HISTO_ENDPOINT})', default=HISTO_ENDPOINT)
+    parser.add_argument('--snapshot', action='store', type=str, help='read a snapshot file instead of querying the parser')
+    parser.add_argument('--field', action='store', choices=list(HISTO_FIELDS), help='histogrammed field (default: Energy)', default="Energy")
+    parser.add_argument('-c', '--channel', action='store', type=int, help='channel (default: sum of all channels)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.snapshot:
+        with np.load(args.snapshot) as snap:
+            counts = snap[args.field]
+        edges = ChannelHistograms().edges(args.field)
+    else:
+        reply = query(args.endpoint, args.field, args.channel)
+        if "error" in reply:
+            print(f"E: {reply['error']}")
+            raise SystemExit(-1)
+        counts = np.array(reply["counts"])
+        edges = np.array(reply["edges"])
+    if args.snapshot and args.channel is not None:
+        counts = counts[args.channel]
+    if counts.ndim > 1:
+        counts = counts.sum(axis=0)
+    total = counts.sum()
+    centers = (edges[:-1] + edges[1:]) / 2
+    mean = (counts * centers).sum() / total if total else 0
+    print(f"I: {args.field} channel {'all' if args.channel is None else args.channel}: {int(total)} entries, mean {mean:.1f}")
+    for lo, n in zip(edges[:-1], counts):
+        if n:
+            print(f"{lo:10.1f} {int(n):12d}")
@@ -0,0 +1,243 @@
+import argparse
+import calendar
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+
+from adc_decode import CRC_FIELD, HIT_DTYPE, HIT_DTYPE_CRC, channel_mask, parse_channels
+from adc_events import TICKS_PER_SECOND, TIMESTAMP_FIELD, UnixTimeUnwrapper, timestamps
+from adc_rotate import open_stored
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from buffered_output import BufferedOutput
+
+# Sparse time index of a parsed hit file, written next to it while the hits
+# are written. Every block of hits gets an index row: first row, where the
+# block starts (byte offset in a CSV file, row group number in a columnar
+# directory), number of hits, first and last time stamp and the mask of the
+# channels in it. Hits do not need to be time-sorted: a query reads every
+# block whose time range and channel mask match.
+#
+# One corrupted time would stretch a block over hours, so the range of a
+# block only covers the seconds within OUTLIER_SECONDS (plus four times the
+# median absolute deviation, for blocks spanning a long time at low rates)
+# of its median second. The outliers get extra rows pointing to the same
+# block, one per run of consecutive seconds. Hits failing the CRC are left
+# out of the ranges: a query only finds them in blocks it reads anyway.
+
+INDEX_EVERY = 4096
+OUTLIER_SECONDS = 2
+INDEX_FIELDS = ["Row", "Offset", "Hits", "Time_min", "Time_max", "Channel_mask"]
+
+COLUMN_TYPES = dict(HIT_DTYPE_CRC.descr + [(TIMESTAMP_FIELD, "<u8")])
+
+
+def index_file_name(filename, parsed_format="csv"):
+    if parsed_format == "npz":
+        return os.path.join(filename, "index.csv")
+    return filename + ".idx"
+
+
+def hit_times(hits, unwrapper):
+    # the event builder time stamp if there is one, same definition otherwise
+    if TIMESTAMP_FIELD in hits.dtype.names:
+        return hits[TIMESTAMP_FIELD]
+    return timestamps(hits, unwrapper.unwrap(hits["Unix_time_16_bit"]))
+
+
+class TimeIndex:
+    def __init__(self, filename, every=INDEX_EVERY, anchor=None):
+        self.every = every
+        self.file = BufferedOutput(filename)
+        self.writer = csv.writer(self.file, dialect="excel")
+        self.writer.writerow(INDEX_FIELDS)
+        self.unwrapper = UnixTimeUnwrapper(anchor)
+        self.block = None
+
+    def begin(self, row, offset):
+        self.block = [row, offset, 0]
+        self.times = []
+        self.channels = []
+
+    def add(self, hits):
+        if len(hits) == 0:
+            return
+        ts = hit_times(hits, self.unwrapper)
+        self.block[2] += len(hits)
+        ch = hits["Channel"]
+        if CRC_FIELD in hits.dtype.names:
+            ok = hits[CRC_FIELD] == 1
+            ts, ch = ts[ok], ch[ok]
+        self.times.append(ts.astype(np.uint64))
+        self.channels.append(ch)
+
+    def end(self):
+        if self.block is not None and self.block[2]:
+            for row in self.block_rows():
+                self.writer.writerow(row)
+            self.file.commit()
+        self.block = None
+
+    def block_rows(self):
+        # the block itself, then its outliers
+        ts = np.concatenate(self.times) if self.times else np.empty(0, np.uint64)
+        ch = np.concatenate(self.channels) if self.channels else np.empty(0, np.uint8)
+        if len(ts) == 0:
+            # nothing with a trusted time, the block never matches
+            return [self.block + [np.iinfo(np.uint64).max, 0, 0]]
+        seconds = (ts // np.uint64(TICKS_PER_SECOND)).astype(np.int64)
+        median = int(np.median(seconds))
+        spread = OUTLIER_SECONDS + 4 * int(np.median(np.abs(seconds - median)))
+        inside = np.abs(seconds - median) <= spread
+        rows = [self.block + time_range(ts[inside], ch[inside])]
+        outliers = np.flatnonzero(~inside)
+        if len(outliers):
+            outliers = outliers[np.argsort(seconds[outliers], kind="stable")]
+            runs = np.split(outliers, np.flatnonzero(np.diff(seconds[outliers]) > 1) + 1)
+            rows += [self.block + time_range(ts[run], ch[run]) for run in runs]
+        return rows
+
+    def close(self):
+        self.end()
+        self.file.close()
+
+
+def time_range(ts, ch):
+    return [int(ts.min()), int(ts.max()), int(np.bitwise_or.reduce(np.left_shift(np.uint32(1), ch.astype(np.uint32))))]
+
+
+def read_index(filename):
+    with open(filename) as f:
+        reader = csv.reader(f)
+        next(reader)
+        return [[int(v) for v in row] for row in reader]
+
+
+def csv_dtype(filename):
+    with open_stored(filename) as f:
+        names = f.readline().decode().strip().split(",")
+    return np.dtype([(name, COLUMN_TYPES[name]) for name in names])
+
+
+def read_csv_block(f, dtype, offset, nhits):
+    f.seek(offset)
+    rows = np.loadtxt([f.readline().decode() for _ in range(nhits)], delimiter=",", dtype=np.uint64, ndmin=2)
+    hits = np.empty(len(rows), dtype=dtype)
+    for i, name in enumerate(dtype.names):
+        hits[name] = rows[:, i]
+    return hits
+
+
+def read_npz_block(dirname, group):
+    with np.load(os.path.join(dirname, f"group_{group:06d}.npz")) as g:
+        hits = np.empty(len(g[g.files[0]]), dtype=[(name, g[name].dtype) for name in g.files])
+        for name in g.files:
+            hits[name] = g[name]
+    return hits
+
+
+def query(filename, start, stop, channels=None):
+    # hits with start <= time < stop, times in time stamp units
+    npz = os.path.isdir(filename)
+    mask = channel_mask(channels) if channels is not None else 0xFFFFFFFF
+    # the rows of every block: its range first, then its outliers
+    rows = {}
+    for b in read_index(index_file_name(filename, "npz" if npz else "csv")):
+        rows.setdefault(b[0], []).append(b)
+    blocks = [block for block in rows.values() if any(b[3] < stop and b[4] >= start and b[5] & mask for b in block)]
+
+    found = []
+    # a rotated segment may have been compressed since, blocks are read in
+    # file order so it is only decompressed once
+    f = None if npz else open_stored(filename)
+    dtype = None if npz else csv_dtype(filename)
+    try:
+        for block in blocks:
+            _, offset, nhits = block[0][:3]
+            hits = read_npz_block(filename, offset) if npz else read_csv_block(f, dtype, offset, nhits)
+            keep = np.zeros(len(hits), dtype=bool)
+            for i, (_, _, _, t_min, t_max, _) in enumerate(block):
+                # unwrapped against the end of each range, as the writer did
+                ts = hit_times(hits, UnixTimeUnwrapper(t_max // TICKS_PER_SECOND))
+                match = (ts >= start) & (ts < stop)
+                if i:
+                    match &= (ts >= t_min) & (ts <= t_max)
+                keep |= match
+            if channels is not None:
+                keep &= np.isin(hits["Channel"], channels)
+            found.append(hits[keep])
+    finally:
+        if f is not None:
+            f.close()
+    return (np.concatenate(found) if found else np.empty(0, dtype=dtype if dtype is not None else HIT_DTYPE), len(blocks))
+
+
+def build_index(filename, every=INDEX_EVERY):
+    # index an existing parsed CSV file written without one
+    dtype = csv_dtype(filename)
+    index = TimeIndex(index_file_name(filename), every, os.path.getmtime(filename))
+    with open(filename, "rb") as f:
+        offset = len(f.readline())
+        row = 0
+        while True:
+            lines = [line for line in (f.readline() for _ in range(every)) if line]
+            if not lines:
+                break
+            rows = np.loadtxt([line.decode() for line in lines], delimiter=",", dtype=np.uint64, ndmin=2)
+            hits = np.empty(len(rows), dtype=dtype)
+            for i, name in enumerate(dtype.names):
+                hits[name] = rows[:, i]
+            index.begin(row, offset)
+            index.add(hits)
+            index.end()
+            offset += sum(len(line) for line in lines)
+            row += len(lines)
+    index.close()
+    return row
+
+
+def parse_time(text):
+    # unix seconds or a UTC date like 2026-10-18T08:15:00, to time stamp units
+    try:
+        seconds = float(text)
+    except ValueError:
+        seconds = calendar.timegm(time.strptime(text, "%Y-%m-%dT%H:%M:%S"))
+    return int(seconds * TICKS_PER_SECOND)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="time range queries on parsed hit files through their sparse index")
+    parser.add_argument('parsed', action='store', type=str, help='parsed hits: output_*_parsed.csv or a columnar directory')
+    parser.add_argument('--start', action='store', type=parse_time, help='start time, unix seconds or UTC YYYY-mm-ddTHH:MM:SS')
+    parser.add_argument('--stop', action='store', type=parse_time, help='stop time (default: 1 s after --start)')
+    parser.add_argument('-c', '--channels', action='store', type=str, help='channels, e.g. 0-6 or 0,2,4 (default: all)')
+    parser.add_argument('-o', '--output', action='store', type=str, help='write the hits found to this CSV file instead of stdout')
+    parser.add_argument('--build', action='store_true', help='build the index of a parsed CSV file written without one')
+    parser.add_argument('--every', action='store', type=int, help=f'hits per index block with --build (default: {INDEX_EVERY})', default=INDEX_EVERY)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.build:
+        n = build_index(args.parsed, args.every)
+        print(f"I: indexed {n} hits of {args.parsed} in blocks of {args.every}")
+        sys.exit(0)
+    if args.start is None:
+        print("E: --start is needed for a query")
+        sys.exit(-1)
+    channels = parse_channels(args.channels) if args.channels else None
+    stop = args.stop if args.stop is not None else args.start + TICKS_PER_SECOND
+
+    t = time.perf_counter()
+    hits, nblocks = query(args.parsed, args.start, stop, channels)
+    print(f"I: {len(hits)} hits from {nblocks} blocks in {time.perf_counter() - t:.3f} s", file=sys.stderr)
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    writer = csv.writer(out, dialect="excel")
+    writer.writerow(hits.dtype.names)
+    writer.writerows(hits.tolist())
+    if args.output:
+        out.close()
@@ -0,0 +1,45 @@
+import queue
+import threading
+import time
+
+from adc_ring import RAW_QUEUE_FULL, RAW_QUEUE_WAIT_US
+
+# Raw output thread of the asyncio ingest. The receive loop hands every
+# message, as (output, parts), to this thread over a bounded queue and goes
+# back to the socket; the thread writes the messages in the order they came.
+# A slow flush only holds the receive back once the queue is full, which is
+# counted in the ring like the writer waiting on a full ring.
+
+INGEST_MODES = ["loop", "asyncio"]
+RAW_QUEUE = 1024
+
+
+class RawWriterThread(threading.Thread):
+    def __init__(self, write, ring, size=RAW_QUEUE):
+        # write(output, parts, t) does the actual output of one message
+        # received at t, stamped on receive so a backlog does not shift it
+        super().__init__(daemon=True)
+        self.write = write
+        self.ring = ring
+        self.queue = queue.Queue(size)
+
+    def put(self, output, parts, t):
+        try:
+            self.queue.put_nowait((output, parts, t))
+        except queue.Full:
+            start = time.perf_counter()
+            self.queue.put((output, parts, t))
+            self.ring.count(RAW_QUEUE_FULL)
+            self.ring.count(RAW_QUEUE_WAIT_US, int((time.perf_counter() - start) * 1e6))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.write(*item)
+
+    # writes what is still queued and stops
+    def stop(self):
+        self.queue.put(None)
+        self.join()
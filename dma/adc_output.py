@@ -0,0 +1,190 @@
+import csv
+import glob
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from adc_decode import FIELDS, HIT_DTYPE
+from adc_index import TimeIndex, index_file_name
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from buffered_output import BufferedOutput, register_output, unregister_output
+
+PARSED_FORMATS = ["csv", "npz"]
+
+ROWS_PER_GROUP = 65536
+
+# default flush policy of each parsed format: CSV rows reach the file within
+# a second, npz writes full row groups only, shorter ones have to be asked for
+PARSED_FLUSH = {"csv": "bytes=1048576,interval=1", "npz": f"rows={ROWS_PER_GROUP}"}
+
+
+class CSVHitWriter:
+    def __init__(self, filename, policy=None, dtype=HIT_DTYPE, index=None):
+        self.file = BufferedOutput(filename, policy)
+        self.writer = csv.writer(self.file, dialect="excel")
+        self.writer.writerow(dtype.names)
+        self.index = index
+        self.rows = 0
+
+    def write(self, hits):
+        if self.index is None:
+            self.writer.writerows(hits.tolist())
+            self.file.commit(len(hits))
+            return
+        # split at the index blocks, so every block starts at a known offset
+        rows = len(hits)
+        while len(hits):
+            fill = self.rows % self.index.every
+            if fill == 0:
+                self.index.end()
+                self.index.begin(self.rows, self.file.bytes_written)
+            n = min(len(hits), self.index.every - fill)
+            self.writer.writerows(hits[:n].tolist())
+            self.index.add(hits[:n])
+            self.rows += n
+            hits = hits[n:]
+        self.file.commit(rows)
+
+    @property
+    def bytes_written(self):
+        return self.file.bytes_written
+
+    def close(self):
+        self.file.close()
+        if self.index is not None:
+            self.index.close()
+
+
+# Columnar output: a directory with one .npz file per row group, holding one
+# typed array per field. Row groups have rows_per_group rows, a shorter one is
+# cut when the pending rows reach the row or byte limit of the flush policy or
+# get older than its interval (checked on write and by the timer of
+# buffered_output), on a signal and at the end of the run.
+class ColumnarHitWriter:
+    def __init__(self, dirname, rows_per_group=ROWS_PER_GROUP, compress=True, dtype=HIT_DTYPE, index=None, policy=None):
+        os.makedirs(dirname, exist_ok=True)
+        for f in glob.glob(os.path.join(dirname, "group_*.npz")):
+            os.remove(f)
+        self.name = dirname
+        self.dirname = dirname
+        self.rows_per_group = rows_per_group
+        self.save = np.savez_compressed if compress else np.savez
+        self.buffer = np.empty(rows_per_group, dtype=dtype)
+        self.fill = 0
+        self.groups = 0
+        self.rows = 0
+        self.bytes_written = 0
+        self.index = index
+        self.policy = policy
+        self.last_flush = time.monotonic()
+        # the timer thread and the signal flush cut groups too; a flush
+        # interrupting a write of the same thread is left to close()
+        self.lock = threading.RLock()
+        self.writing = False
+        register_output(self, bool(policy and policy.max_interval))
+
+    def write(self, hits):
+        with self.lock:
+            self.writing = True
+            try:
+                while len(hits):
+                    n = min(len(hits), self.rows_per_group - self.fill)
+                    self.buffer[self.fill:self.fill + n] = hits[:n]
+                    self.fill += n
+                    hits = hits[n:]
+                    if self.fill == self.rows_per_group:
+                        self.write_group()
+                if self.policy is not None and self.flush_wanted():
+                    self.write_group()
+            finally:
+                self.writing = False
+
+    def flush_wanted(self):
+        p = self.policy
+        return ((p.max_rows and self.fill >= p.max_rows) or
+                (p.max_bytes and self.fill * self.buffer.itemsize >= p.max_bytes) or
+                (p.max_interval and time.monotonic() - self.last_flush >= p.max_interval) or
+                not (p.max_rows or p.max_bytes or p.max_interval))
+
+    def flush_due(self):
+        p = self.policy
+        if p and p.max_interval and self.fill and time.monotonic() - self.last_flush >= p.max_interval:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.writing:
+                self.write_group()
+
+    def write_group(self):
+        self.last_flush = time.monotonic()
+        if self.fill == 0:
+            return
+        rows = self.buffer[:self.fill]
+        name = os.path.join(self.dirname, f"group_{self.groups:06d}.npz")
+        self.save(name, **{field: rows[field] for field in rows.dtype.names})
+        self.bytes_written += os.path.getsize(name)
+        if self.index is not None:
+            # one index block per row group
+            self.index.begin(self.rows, self.groups)
+            self.index.add(rows)
+            self.index.end()
+        self.groups += 1
+        self.rows += self.fill
+        self.fill = 0
+
+    def close(self):
+        unregister_output(self)
+        with self.lock:
+            self.writing = True
+            self.write_group()
+        if self.index is not None:
+            self.index.close()
+
+
+def check_files_exist(fnames):
+    # one question for all the output files that are already there
+    fnames = [fname for fname in fnames if os.path.exists(fname)]
+    if fnames:
+        what = f'file {fnames[0]} exists' if len(fnames) == 1 else f'{len(fnames)} files like {fnames[0]} exist'
+        while True:
+            res = input(f'I: {what} - do you want overwrite (Y/N) ')
+            if res.lower() in ["y", "yes"]:
+                break
+            elif res.lower() in ["n", "no"]:
+                print("E: specify different filename")
+                sys.exit(-1)
+
+
+def open_hit_writer(filename, parsed_format="csv", policy=None, dtype=HIT_DTYPE, index_every=0, index_anchor=None):
+    if parsed_format == "npz":
+        os.makedirs(filename, exist_ok=True)
+    index = TimeIndex(index_file_name(filename, parsed_format), index_every, index_anchor) if index_every else None
+    if parsed_format == "npz":
+        return ColumnarHitWriter(filename, dtype=dtype, index=index, policy=policy)
+    return CSVHitWriter(filename, policy, dtype, index)
+
+
+def load_columns(dirname, fields=None):
+    groups = sorted(glob.glob(os.path.join(dirname, "group_*.npz")))
+    columns = {}
+    for name in groups:
+        with np.load(name) as group:
+            for field in (fields if fields is not None else group.files):
+                columns.setdefault(field, []).append(group[field])
+    if not columns:
+        return {field: np.empty(0, HIT_DTYPE[field]) for field in (fields if fields is not None else FIELDS)}
+    return {field: np.concatenate(arrays) for field, arrays in columns.items()}
+
+
+def load_hits(dirname):
+    columns = load_columns(dirname)
+    names = [field for field in FIELDS if field in columns] + [field for field in columns if field not in FIELDS]
+    hits = np.empty(len(columns[names[0]]), dtype=[(field, columns[field].dtype) for field in names])
+    for field in names:
+        hits[field] = columns[field]
+    return hits
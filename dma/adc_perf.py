@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import signal
+import threading
+import time
+
+import zmq
+
+# Always-on timing of the writer and parser hot paths. One frame in
+# SAMPLE_EVERY is timed step by step with perf_counter_ns, each step into a
+# histogram of log2 buckets (bucket k holds [2^(k-1), 2^k) ns); the other
+# frames only pay for a countdown and a few boolean checks. The idle wait for
+# the board or the ring is a step of its own, "wait", so that it does not
+# hide in the first step of the frame. Each process prints
+# its table on SIGUSR1 (the main process forwards it) and at the end of the
+# run, and answers queries on a local REP socket.
+
+SAMPLE_EVERY = 16
+BUCKETS = 64
+PERF_ENDPOINT = "tcp://127.0.0.1:5560"
+# the writer answers on the endpoint, the parser on the next port
+PROCESSES = ("writer", "parser")
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns):
+        self.buckets[ns.bit_length()] += 1
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, q):
+        # upper edge of the bucket holding the q quantile, at most the max
+        seen = 0
+        for k, n in enumerate(self.buckets):
+            seen += n
+            if seen >= q * self.count:
+                return min(1 << k, self.max)
+        return self.max
+
+    def summary(self):
+        last = max((k for k, n in enumerate(self.buckets) if n), default=0)
+        return {
+            "count": self.count,
+            "total_ns": self.total,
+            "mean_ns": self.total / self.count if self.count else 0,
+            "p50_ns": self.percentile(0.5),
+            "p99_ns": self.percentile(0.99),
+            "max_ns": self.max,
+            "buckets": self.buckets[:last + 1],
+        }
+
+
+class Perf:
+    def __init__(self, process, sample_every=SAMPLE_EVERY):
+        self.process = process
+        self.sample_every = sample_every
+        self.countdown = 1
+        self.started = time.time()
+        self.timing = False
+        self.last = 0
+        self.steps = {}
+
+    # starts a frame and returns whether it is timed, the following laps
+    # are recorded only then
+    def frame(self):
+        self.countdown -= 1
+        if self.countdown:
+            self.timing = False
+            return False
+        self.countdown = self.sample_every
+        self.timing = True
+        self.last = time.perf_counter_ns()
+        return True
+
+    # time since the previous lap (or the frame start) goes to step;
+    # callers check the frame is timed first so the others skip the call
+    def lap(self, step):
+        now = time.perf_counter_ns()
+        self.record(step, now - self.last)
+        self.last = now
+
+    def record(self, step, ns):
+        histo = self.steps.get(step)
+        if histo is None:
+            histo = self.steps[step] = LatencyHistogram()
+        histo.record(max(ns, 0))
+
+    def summary(self):
+        return {
+            "process": self.process,
+            "pid": os.getpid(),
+            "seconds": time.time() - self.started,
+            "sample_every": self.sample_every,
+            "steps": {step: histo.summary() for step, histo in list(self.steps.items())},
+        }
+
+    def print(self):
+        for line in summary_lines(self.summary()):
+            print(line)
+
+    def install(self, endpoint=None):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.print())
+        if endpoint:
+            server = PerfServer(self, endpoint)
+            server.start()
+            return server
+        return None
+
+
+def format_ns(ns):
+    if ns >= 1e9:
+        return f"{ns / 1e9:.2f} s"
+    if ns >= 1e6:
+        return f"{ns / 1e6:.2f} ms"
+    if ns >= 1e3:
+        return f"{ns / 1e3:.1f} us"
+    return f"{ns:.0f} ns"
+
+
+def summary_lines(summary):
+    lines = [f"I: perf {summary['process']}: {summary['seconds']:.1f} s, 1 frame in {summary['sample_every']} timed"]
+    for step, s in summary["steps"].items():
+        lines.append(f"I: perf {summary['process']} {step}: {s['count']} samples, mean {format_ns(s['mean_ns'])}, "
+                     f"p50 <={format_ns(s['p50_ns'])}, p99 <={format_ns(s['p99_ns'])}, max {format_ns(s['max_ns'])}")
+    return lines
+
+
+class PerfServer(threading.Thread):
+    def __init__(self, perf, endpoint=PERF_ENDPOINT):
+        super().__init__(daemon=True)
+        self.perf = perf
+        self.endpoint = endpoint
+        self.running = True
+
+    def run(self):
+        context = zmq.Context.instance()
+        socket = context.socket(zmq.REP)
+        try:
+            socket.bind(self.endpoint)
+        except zmq.ZMQError as e:
+            print(f"E: perf endpoint {self.endpoint} not available: {e}")
+            socket.close(linger=0)
+            return
+        try:
+            while self.running:
+                if socket.poll(200):
+                    socket.recv()
+                    socket.send(json.dumps(self.perf.summary()).encode())
+        finally:
+            socket.close(linger=0)
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+
+def process_endpoint(endpoint, process):
+    # tcp://host:port of the writer, port + 1 for the parser
+    if not endpoint:
+        return None
+    base, _, port = endpoint.rpartition(":")
+    return f"{base}:{int(port) + PROCESSES.index(process)}"
+
+
+def query(endpoint, timeout=2000):
+    context = zmq.Context.instance()
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.RCVTIMEO, timeout)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(endpoint)
+    try:
+        socket.send(b"{}")
+        return json.loads(socket.recv())
+    finally:
+        socket.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="print the hot-path timings of a running ADC_parsing")
+    parser.add_argument('--endpoint', action='store', type=str, help='perf endpoint of the writer, the parser is on the next port (default: tcp://localhost:5560)', default="tcp://localhost:5560")
+    parser.add_argument('--buckets', action='store_true', help='also print the log2 latency buckets of every step')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for process in PROCESSES:
+        endpoint = process_endpoint(args.endpoint, process)
+        try:
+            summary = query(endpoint)
+        except zmq.Again:
+            print(f"E: no answer from the {process} on {endpoint}")
+            continue
+        for line in summary_lines(summary):
+            print(line)
+        if args.buckets:
+            for step, s in summary["steps"].items():
+                print(f"I: perf {process} {step} buckets: " + " ".join(f"<{format_ns(1 << k)}:{n}" for k, n in enumerate(s["buckets"]) if n))
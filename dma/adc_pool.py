@@ -0,0 +1,130 @@
+import functools
+import multiprocessing
+import os
+import threading
+import time
+
+from adc_decode import decode_buffer
+
+BATCH_FRAMES = 64
+BATCH_TIMEOUT = 0.05
+REPORT_INTERVAL = 10
+# batches in flight per worker: beyond this the frames stay in the ring
+PENDING_PER_WORKER = 4
+
+
+def ring_batches(ring, batch_frames=BATCH_FRAMES, timeout=BATCH_TIMEOUT):
+    # frames are copied out of the ring so that they can be sent to the workers;
+    # a partial batch is handed out as soon as the ring stays empty for timeout
+    batch = []
+    while True:
+        frame = ring.get(timeout=timeout)
+        if frame is None:
+            if batch:
+                yield batch
+                batch = []
+            if ring.drained():
+                break
+            continue
+        seq, t, board, payload = frame
+        batch.append((seq, t, board, payload.tobytes()))
+        if len(batch) >= batch_frames:
+            yield batch
+            batch = []
+    ring.release()
+
+
+def decode_frames(ring, check_crc=False, perf=None):
+    # in-process decoding straight from the zero-copy ring views
+    while True:
+        if perf is not None and perf.frame():
+            ring.wait()
+            perf.lap("wait")
+        frame = ring.get()
+        if frame is None:
+            break
+        seq, t, board, payload = frame
+        if perf is not None and perf.timing:
+            perf.lap("ring_get")
+        hits = decode_buffer(payload, check_crc)
+        if perf is not None and perf.timing:
+            perf.lap("decode")
+        yield seq, t, board, hits
+    ring.release()
+
+
+def decode_batch(batch, check_crc=False):
+    # frames are (..., payload), whatever comes before the payload is passed on
+    start = time.perf_counter()
+    decoded = [frame[:-1] + (decode_buffer(frame[-1], check_crc),) for frame in batch]
+    nbytes = sum(len(frame[-1]) for frame in batch)
+    return os.getpid(), time.perf_counter() - start, nbytes, decoded
+
+
+class WorkerStats:
+    def __init__(self):
+        self.batches = 0
+        self.frames = 0
+        self.hits = 0
+        self.bytes = 0
+        self.busy = 0.0
+
+    def add(self, busy, nbytes, decoded):
+        self.batches += 1
+        self.frames += len(decoded)
+        self.hits += sum(len(frame[-1]) for frame in decoded)
+        self.bytes += nbytes
+        self.busy += busy
+
+    def line(self, pid):
+        mbs = self.bytes / self.busy / 1e6 if self.busy else 0
+        hps = self.hits / self.busy if self.busy else 0
+        return f"I: worker {pid}: {self.frames} frames, {self.hits} hits, {mbs:.1f} MB/s, {hps:.0f} hits/s while busy"
+
+
+class ParserPool:
+    def __init__(self, workers, batch_frames=BATCH_FRAMES, check_crc=False):
+        self.workers = workers
+        self.batch_frames = batch_frames
+        self.check_crc = check_crc
+        self.pool = multiprocessing.Pool(workers)
+        self.stats = {}
+        self.last_report = time.time()
+
+    # decodes the frames of the ring on the workers and yields (seq, t, board, hits)
+    # in frame-sequence order
+    def decode(self, ring):
+        return self.decode_batches(ring_batches(ring, self.batch_frames))
+
+    def decode_batches(self, batches):
+        # the pool takes tasks from its own unbounded queue, hold the feeder
+        # back so that a slow parser shows up as a full ring, not memory
+        slots = threading.Semaphore(PENDING_PER_WORKER * self.workers)
+        stopping = threading.Event()
+
+        def bounded():
+            for batch in batches:
+                if not stopping.is_set():
+                    slots.acquire()
+                yield batch
+
+        try:
+            for pid, busy, nbytes, decoded in self.pool.imap(functools.partial(decode_batch, check_crc=self.check_crc), bounded()):
+                slots.release()
+                self.stats.setdefault(pid, WorkerStats()).add(busy, nbytes, decoded)
+                for frame in decoded:
+                    yield frame
+                if time.time() - self.last_report >= REPORT_INTERVAL:
+                    self.report()
+        finally:
+            stopping.set()
+            slots.release()
+
+    def report(self):
+        self.last_report = time.time()
+        for pid in sorted(self.stats):
+            print(self.stats[pid].line(pid))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
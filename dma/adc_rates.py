@@ -0,0 +1,126 @@
+import argparse
+import collections
+import json
+import threading
+import time
+
+import numpy as np
+import zmq
+
+from adc_decode import CHANNELS, words_from_buffer
+
+# Live rates of the writer. The receive loop only adds each frame to running
+# totals (frames, bytes, hits per channel); a publisher thread samples the
+# totals at a fixed cadence and publishes the rates over rolling windows as
+# JSON on a PUB socket, topic "rates". An optional stats callable adds the
+# ring buffer and loss counters to every message.
+
+RATES_ENDPOINT = "tcp://*:5557"
+RATES_INTERVAL = 1.0
+RATE_WINDOWS = (1, 10, 60)
+RATES_TOPIC = b"rates"
+
+
+class RateCounter:
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.hits = np.zeros(CHANNELS, dtype=np.int64)
+
+    def add(self, part):
+        self.frames += 1
+        self.bytes += len(part)
+        words = words_from_buffer(part)
+        self.hits += np.bincount((words[:, 1] >> 8) & (CHANNELS - 1), minlength=CHANNELS)
+
+    def sample(self):
+        return time.monotonic(), self.frames, self.bytes, self.hits.copy()
+
+
+def window_rates(old, new):
+    t0, frames0, bytes0, hits0 = old
+    t1, frames1, bytes1, hits1 = new
+    dt = t1 - t0
+    if dt <= 0:
+        return None
+    channels = (hits1 - hits0) / dt
+    return {
+        "seconds": round(dt, 3),
+        "hits_per_s": float(channels.sum()),
+        "frames_per_s": (frames1 - frames0) / dt,
+        "bytes_per_s": (bytes1 - bytes0) / dt,
+        "channels": channels.tolist(),
+    }
+
+
+class RatePublisher(threading.Thread):
+    def __init__(self, counter, context, endpoint=RATES_ENDPOINT, interval=RATES_INTERVAL, windows=RATE_WINDOWS, stats=None):
+        super().__init__(daemon=True)
+        self.counter = counter
+        self.stats = stats
+        self.context = context
+        self.endpoint = endpoint
+        self.interval = interval
+        self.windows = windows
+        self.samples = collections.deque(maxlen=int(max(windows) / interval) + 2)
+        self.running = threading.Event()
+
+    def rates(self):
+        new = self.samples[-1]
+        rates = {}
+        for window in self.windows:
+            # the oldest sample still inside the window, the whole history at the start of the run
+            old = next((s for s in self.samples if new[0] - s[0] <= window + self.interval / 2), self.samples[0])
+            r = window_rates(old, new)
+            if r is not None:
+                rates[str(window)] = r
+        message = {"time": time.time(), "frames": new[1], "bytes": new[2], "hits": int(new[3].sum()), "windows": rates}
+        if self.stats is not None:
+            message["stats"] = self.stats()
+        return message
+
+    def run(self):
+        socket = self.context.socket(zmq.PUB)
+        socket.bind(self.endpoint)
+        self.samples.append(self.counter.sample())
+        try:
+            while not self.running.wait(self.interval):
+                self.samples.append(self.counter.sample())
+                socket.send_multipart([RATES_TOPIC, json.dumps(self.rates()).encode()])
+        finally:
+            socket.close(linger=0)
+
+    def stop(self):
+        self.running.set()
+        self.join()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="print the live rates published by ADC_parsing")
+    parser.add_argument('--endpoint', action='store', type=str, help='rates endpoint (default: tcp://localhost:5557)', default="tcp://localhost:5557")
+    parser.add_argument('--window', action='store', type=str, help=f'rolling window in seconds, one of {",".join(str(w) for w in RATE_WINDOWS)} (default: 10)', default="10")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    context = zmq.Context()
+    socket = context.socket(zmq.SUB)
+    socket.setsockopt(zmq.SUBSCRIBE, RATES_TOPIC)
+    socket.connect(args.endpoint)
+    try:
+        while True:
+            topic, payload = socket.recv_multipart()
+            r = json.loads(payload)["windows"].get(args.window)
+            if r is None:
+                continue
+            channels = " ".join(f"{c}:{rate:.0f}" for c, rate in enumerate(r["channels"]) if rate)
+            print(f"I: {r['hits_per_s']:.0f} hits/s {r['frames_per_s']:.0f} frames/s {r['bytes_per_s'] / 1e6:.2f} MB/s over {r['seconds']:.0f} s - {channels}")
+            stats = json.loads(payload).get("stats")
+            if stats is not None and (stats["dropped_frames"] or stats["blocked_us"]):
+                print(f"I: ring {stats['used']}/{stats['capacity']} bytes, dropped {stats['dropped_frames']} frames, writer blocked {stats['blocked_us'] / 1e6:.2f} s")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        socket.close()
+        context.term()
@@ -0,0 +1,163 @@
+import argparse
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import zmq
+
+from adc_capture import CaptureWriter
+from adc_ring import ShmRing
+from adc_simulator import DEFAULT_SIM_CHANNELS, HitGenerator, parse_channel_mix, simulate
+from adc_decode import HIT_WORDS
+from adc_perf import Perf
+from ADC_parsing import HexRowWriter
+
+# Cost of the writer receive path per MB received: the same receive, raw
+# write and ring push as ADC_parsing.writer, fed by the simulator as fast as
+# it can send. CPU time is the receiving process only. CPython has no
+# cumulative allocation counter: a second pass traces allocations and adds
+# up, message by message, the Python memory allocated on top of what was
+# live before the message (received copies, word tuples, row strings).
+# --no-perf leaves out the hot-path timing, to measure what it costs.
+# --legacy also runs the receive path as it was before the zero-copy frames
+# and the vectorized hex rows (copied parts, one struct.unpack per part and
+# a Python loop per word), and prints both results.
+
+ENDPOINT = "tcp://127.0.0.1:5559"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CPU and allocations per MB of the ADC_parsing writer receive path")
+    parser.add_argument('--mb', action='store', type=float, help='MB to receive per pass (default: 100)', default=100)
+    parser.add_argument('--frame', action='store', type=int, help='hits per ZMQ frame (default: 100)', default=100)
+    parser.add_argument('--raw-format', action='store', choices=['csv', 'bin'], help='raw capture format (default: bin)', default="bin")
+    parser.add_argument('--copy', action='store_true', help='receive into bytes copies instead of zero-copy frames')
+    parser.add_argument('--no-perf', action='store_true', help='without the hot-path timing of the writer')
+    parser.add_argument('--legacy', action='store_true', help='also run the legacy receive path (copies, per-word hex loop) as a baseline')
+    return parser.parse_args()
+
+
+class LegacyHexRowWriter(HexRowWriter):
+    # the hex CSV writer before the vectorized rows: word by word
+    def write(self, part, t=None):
+        l = int(len(part) / 2)
+        v = struct.unpack_from(f"{l}H", part)
+        i = 0
+        a = ""
+        for b in v:
+            value = f'{b:04x} '
+            print(value, end='')
+            i += 1
+            a += value
+            if i % 8 == 0:
+                try:
+                    self.writer.writerow({"DMA data row": a.strip()})
+                    self.file.commit()
+                    a = ""
+                    print("")
+                    i = 0
+                except Exception as e:
+                    print(f"It was not possible to write the data on the file: {e}")
+
+
+def drain(ring_name):
+    ring = ShmRing.attach(ring_name)
+    while ring.get() is not None:
+        pass
+    ring.close()
+
+
+def receive(args, traced=False, legacy=False):
+    hits = int(args.mb * 1e6 / (HIT_WORDS * 2))
+    channels, weights = parse_channel_mix(",".join(str(c) for c in range(DEFAULT_SIM_CHANNELS)))
+    sender = multiprocessing.Process(target=simulate, args=(ENDPOINT, HitGenerator(channels, weights, seed=1), 0, hits, 10 * args.frame, args.frame))
+    ring = ShmRing.create(64 * 1024 * 1024)
+    consumer = multiprocessing.Process(target=drain, args=(ring.name,))
+
+    context = zmq.Context()
+    frontend = context.socket(zmq.ROUTER)
+    frontend.bind(ENDPOINT)
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    tmp.close()
+    perf = None if args.no_perf else Perf("writer")
+    copy = args.copy or legacy
+    if args.raw_format == "bin":
+        file = CaptureWriter(tmp.name)
+    else:
+        file = LegacyHexRowWriter(tmp.name) if legacy else HexRowWriter(tmp.name, perf=perf)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+
+    consumer.start()
+    sender.start()
+    received = 0
+    seq = 0
+    allocated = 0
+    if traced:
+        tracemalloc.start()
+    cpu = time.process_time()
+    start = time.perf_counter()
+    try:
+        while received < hits * HIT_WORDS * 2:
+            if traced:
+                live = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            timing = perf is not None and perf.frame()
+            if timing:
+                frontend.poll()
+                perf.lap("wait")
+            message = frontend.recv_multipart(copy=copy)
+            if timing:
+                perf.lap("recv")
+            print("Message received")
+            for part in message:
+                if not copy:
+                    part = part.buffer
+                if len(part) != 1:
+                    file.write(part)
+                    if timing:
+                        perf.lap("raw_write")
+                    ring.push(part, seq)
+                    seq += 1
+                    if timing:
+                        perf.lap("ring_push")
+                    received += len(part)
+            if traced:
+                allocated += tracemalloc.get_traced_memory()[1] - live
+    finally:
+        cpu = time.process_time() - cpu
+        wall = time.perf_counter() - start
+        tracemalloc.stop()
+        sys.stdout.close()
+        sys.stdout = stdout
+        sender.join()
+        ring.close_writer()
+        consumer.join()
+        ring.close()
+        ring.unlink()
+        file.close()
+        frontend.close()
+        context.term()
+        os.remove(tmp.name)
+    mb = received / 1e6
+    return mb, cpu, wall, allocated / mb
+
+
+def report(args, legacy=False):
+    mb, cpu, wall, _ = receive(args, legacy=legacy)
+    _, _, _, allocated = receive(args, traced=True, legacy=legacy)
+    mode = "legacy" if legacy else ("copy" if args.copy else "zero-copy")
+    mode += "" if args.no_perf else " timed"
+    print(f"I: {mode:>15} {args.raw_format}: {mb:.0f} MB in {wall:.2f} s ({mb / wall:.1f} MB/s), CPU {cpu / mb * 1000:.2f} ms/MB, "
+          f"Python allocations {allocated / 1e6:.2f} MB/MB")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.legacy:
+        report(args, legacy=True)
+    report(args)
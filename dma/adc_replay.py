@@ -0,0 +1,183 @@
+import argparse
+import itertools
+import os
+import time
+
+from adc_decode import decode_buffer, words_from_rows
+from adc_capture import CAPTURE_MAGIC, iter_frames, open_capture
+from adc_pool import BATCH_FRAMES, ParserPool
+from adc_output import PARSED_FORMATS, check_files_exist, open_hit_writer
+from adc_index import INDEX_EVERY
+from adc_crc import CRC_MODES, CrcStage
+from adc_filter import FilterStage, parse_thresholds, parse_window
+from adc_summary import SummaryStage
+from adc_events import SORT_WINDOW, EventStage
+from adc_coinc import COINC_MULTIPLICITY, CoincidenceStage
+from adc_stages import finish_stages, output_dtype, run_stages
+from adc_decode import HIT_DTYPE, HIT_DTYPE_CRC, parse_channels
+
+ROWS_PER_BATCH = 8192
+REPORT_INTERVAL = 5
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="re-decode a raw capture (hex CSV or binary) offline")
+    parser.add_argument('capture', action='store', type=str, help='raw capture file (output_*.csv or output_*.bin)')
+    parser.add_argument('-o', '--output', action='store', type=str, help='parsed output filename (default: <capture>_parsed)')
+    parser.add_argument('--parsed-format', action='store', choices=PARSED_FORMATS, help='parsed hits format (default: csv)', default="csv")
+    parser.add_argument('-j', '--workers', action='store', type=int, help='number of parser worker processes (default: 1)', default=1)
+    parser.add_argument('--index', action='store_true', help='write a sparse time index next to the parsed hits')
+    parser.add_argument('--index-every', action='store', type=int, help=f'hits per index block of a CSV output (default: {INDEX_EVERY})', default=INDEX_EVERY)
+    parser.add_argument('--crc', action='store', choices=CRC_MODES, help='CRC check: off, tag or drop (default: off)', default="off")
+    parser.add_argument('--summary', action='store_true', help='write per-second per-channel aggregates to <output>_summary')
+    parser.add_argument('--keep-channels', action='store', type=parse_channels, help='keep only the hits of these channels, e.g. 0-6 (default: all)')
+    parser.add_argument('--energy-min', action='store', type=parse_thresholds, help='keep only the hits at or above this energy: 100, or per channel 0=120,3=90, or 100,3=250 (default: no threshold)')
+    parser.add_argument('--tot-window', action='store', type=parse_window, help='keep only the hits with a ToT in this range, e.g. 2-40 (default: any)')
+    parser.add_argument('--sort-window', action='store', type=float, help='time-sort the hits across channels within this many ms and add a Timestamp column (default: 0, file order)', default=0)
+    parser.add_argument('--coinc-window', action='store', type=float, help='find coincidences within this many ns and write them to <output>_coinc, implies --sort-window (default: 0, off)', default=0)
+    parser.add_argument('--coinc-multiplicity', action='store', type=int, help=f'minimum number of different channels in a coincidence (default: {COINC_MULTIPLICITY})', default=COINC_MULTIPLICITY)
+    parser.add_argument('--coinc-channels', action='store', type=parse_channels, help='channels taking part in coincidences, e.g. 0-6 or 0,2,4 (default: all)')
+    parser.add_argument('--no-output', action='store_true', help='decode only, to benchmark the decoding stage')
+    return parser.parse_args()
+
+
+def is_binary_capture(fname):
+    with open(fname, "rb") as f:
+        return f.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC
+
+
+# Both readers yield batches of (seq, t, payload) frames in the format used by
+# the live parser, payload being the 16-bit words in native byte order.
+
+def csv_batches(fname, rows_per_batch=ROWS_PER_BATCH):
+    with open(fname, "r") as f:
+        f.readline()
+        seq = 0
+        while True:
+            rows = [row.strip().strip('"') for row in itertools.islice(f, rows_per_batch)]
+            if not rows:
+                break
+            yield [(seq, 0.0, words_from_rows(rows).tobytes())]
+            seq += 1
+
+
+def capture_batches(fname, batch_frames=BATCH_FRAMES):
+    frames = iter_frames(open_capture(fname))
+    while True:
+        batch = [(seq, t, payload) for seq, t, payload in itertools.islice(frames, batch_frames)]
+        if not batch:
+            break
+        yield batch
+
+
+def decode_local(batches, check_crc=False):
+    for batch in batches:
+        for seq, t, payload in batch:
+            yield seq, t, decode_buffer(payload, check_crc)
+
+
+def copy_payloads(batches):
+    # mmap views cannot be sent to the workers
+    for batch in batches:
+        yield [(seq, t, bytes(payload)) for seq, t, payload in batch]
+
+
+def capture_anchor(fname):
+    # host time of the first frame of a binary capture; a CSV capture has
+    # none, its last write is the best guess (the unix time is unwrapped to
+    # the nearest second, right for captures of up to about 9 hours)
+    if is_binary_capture(fname):
+        for _, t, _ in iter_frames(open_capture(fname)):
+            return t
+    return os.path.getmtime(fname)
+
+
+def side_file_name(output, parsed_format, suffix):
+    if parsed_format == "npz":
+        return output + suffix
+    return output.rsplit(".", 1)[0] + suffix + ".csv"
+
+
+def replay(args):
+    if is_binary_capture(args.capture):
+        batches = capture_batches(args.capture)
+    else:
+        batches = csv_batches(args.capture)
+
+    # the summary reports the CRC failures even with --crc off
+    check_crc = args.crc != "off" or args.summary
+    stages = []
+    anchor = capture_anchor(args.capture)
+    if args.summary:
+        stages.append(SummaryStage(side_file_name(args.output, args.parsed_format, "_summary"), args.parsed_format, anchor=anchor, crc_filter=args.crc != "off"))
+    if check_crc:
+        stages.append(CrcStage(args.crc))
+    if args.keep_channels is not None or args.energy_min is not None or args.tot_window is not None:
+        stages.append(FilterStage(args.keep_channels, args.energy_min, args.tot_window))
+    if args.coinc_window > 0 and args.sort_window <= 0:
+        args.sort_window = SORT_WINDOW * 1000
+    if args.sort_window > 0:
+        stages.append(EventStage(args.sort_window / 1000, anchor))
+    if args.coinc_window > 0:
+        stages.append(CoincidenceStage(side_file_name(args.output, args.parsed_format, "_coinc"), args.parsed_format, window=args.coinc_window,
+                                       multiplicity=args.coinc_multiplicity, channels=args.coinc_channels))
+
+    pool = None
+    if args.workers > 1:
+        pool = ParserPool(args.workers, check_crc=check_crc)
+        frames = pool.decode_batches(copy_payloads(batches))
+    else:
+        frames = decode_local(batches, check_crc)
+
+    out = None
+    if not args.no_output:
+        out = open_hit_writer(args.output, args.parsed_format, dtype=output_dtype(stages, HIT_DTYPE_CRC if check_crc else HIT_DTYPE),
+                              index_every=args.index_every if args.index else 0, index_anchor=anchor)
+
+    size = os.path.getsize(args.capture)
+    nhits = 0
+    start = time.perf_counter()
+    last_report = start
+    for stage in stages:
+        stage.start()
+    try:
+        for seq, t, hits in frames:
+            nhits += len(hits)
+            hits = run_stages(stages, hits)
+            if out is not None and len(hits):
+                out.write(hits)
+            now = time.perf_counter()
+            if now - last_report >= REPORT_INTERVAL:
+                print(f"I: {nhits} hits, {nhits / (now - start):.0f} hits/s")
+                last_report = now
+        for hits in finish_stages(stages):
+            if out is not None:
+                out.write(hits)
+    finally:
+        if out is not None:
+            out.close()
+        for stage in stages:
+            stage.close()
+        if pool is not None:
+            pool.close()
+            pool.report()
+
+    elapsed = time.perf_counter() - start
+    print(f"I: {nhits} hits from {size / 1e6:.1f} MB in {elapsed:.2f} s - {nhits / elapsed:.0f} hits/s, {size / 1e6 / elapsed:.1f} MB/s")
+    return nhits
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.output is None:
+        base = args.capture.rsplit(".", 1)[0]
+        args.output = base + "_parsed" + ("" if args.parsed_format == "npz" else ".csv")
+    fnames = []
+    if not args.no_output:
+        fnames.append(args.output)
+    if args.coinc_window > 0:
+        fnames.append(side_file_name(args.output, args.parsed_format, "_coinc"))
+    if args.summary:
+        fnames.append(side_file_name(args.output, args.parsed_format, "_summary"))
+    check_files_exist(fnames)
+    replay(args)
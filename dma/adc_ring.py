@@ -0,0 +1,210 @@
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from adc_capture import FRAME_HEADER, padded_length
+
+# Single-producer/single-consumer ring buffer in shared memory. The first
+# CONTROL_SIZE bytes hold the control block, the rest is the data area where
+# every frame is stored as a FRAME_HEADER followed by the padded payload.
+# head and tail are free-running byte counters: only the producer writes
+# head, only the consumer writes tail, so no lock is needed. A frame never
+# wraps: when it does not fit before the end of the data area a WRAP marker
+# is written (if there is room for a header) and the frame starts again at 0.
+
+CONTROL_SIZE = 256
+WRAP = 0xFFFFFFFF
+
+HEAD, TAIL, HWM, DROPPED_FRAMES, DROPPED_BYTES, CLOSED, CAPACITY = range(7)
+# consumer side: frames and hits handled and writer to parser latency in us
+FRAMES_OUT, HITS_OUT, LATENCY_SUM, LATENCY_MAX = range(8, 12)
+# producer side: frames offered to the ring and time spent waiting for room
+FRAMES_IN, BYTES_IN, BLOCKED_US = range(12, 15)
+# loss and error counters of both sides, see count()
+PARTIAL_FRAMES, RAW_WRITE_ERRORS, EMPTY_FRAMES, PARSE_ERRORS, PARSED_WRITE_ERRORS = range(16, 21)
+# asyncio ingest: receive held back by a full raw output queue
+RAW_QUEUE_FULL, RAW_QUEUE_WAIT_US = range(21, 23)
+
+OVERFLOW_POLICIES = ["block", "drop"]
+
+POLL_INTERVAL = 0.0002
+
+
+class ShmRing:
+    def __init__(self, shm, overflow="block"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"E: unknown overflow policy {overflow}")
+        self.shm = shm
+        self.overflow = overflow
+        self.ctrl = np.ndarray((CONTROL_SIZE // 8,), dtype=np.uint64, buffer=shm.buf)
+        self.capacity = int(self.ctrl[CAPACITY])
+        self.data = np.ndarray((self.capacity,), dtype=np.uint8, buffer=shm.buf, offset=CONTROL_SIZE)
+        self.pending = 0
+
+    @classmethod
+    def create(cls, capacity, overflow="block"):
+        capacity = padded_length(capacity)
+        shm = shared_memory.SharedMemory(create=True, size=CONTROL_SIZE + capacity)
+        ctrl = np.ndarray((CONTROL_SIZE // 8,), dtype=np.uint64, buffer=shm.buf)
+        ctrl[:] = 0
+        ctrl[CAPACITY] = capacity
+        del ctrl
+        return cls(shm, overflow)
+
+    @classmethod
+    def attach(cls, name, overflow="block"):
+        return cls(shared_memory.SharedMemory(name=name), overflow)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def push(self, part, seq, t=None, board=0):
+        if t is None:
+            t = time.time()
+        n = len(part)
+        self.ctrl[FRAMES_IN] += 1
+        self.ctrl[BYTES_IN] += n
+        need = FRAME_HEADER.size + padded_length(n)
+        if need > self.capacity:
+            self._drop(n)
+            return False
+
+        head = int(self.ctrl[HEAD])
+        pos = head % self.capacity
+        end = self.capacity - pos
+        total = need if need <= end else end + need
+
+        blocked = None
+        while self.capacity - (head - int(self.ctrl[TAIL])) < total:
+            if self.overflow == "drop":
+                self._drop(n)
+                return False
+            if blocked is None:
+                blocked = time.perf_counter()
+            time.sleep(POLL_INTERVAL)
+        if blocked is not None:
+            self.ctrl[BLOCKED_US] += int((time.perf_counter() - blocked) * 1e6)
+
+        if need > end:
+            if end >= FRAME_HEADER.size:
+                FRAME_HEADER.pack_into(self.data, pos, 0, 0.0, WRAP, 0)
+            head += end
+            pos = 0
+
+        FRAME_HEADER.pack_into(self.data, pos, seq, t, n, board)
+        self.data[pos + FRAME_HEADER.size:pos + FRAME_HEADER.size + n] = np.frombuffer(part, dtype=np.uint8)
+        head += need
+        # publishing head last makes the frame visible to the consumer
+        self.ctrl[HEAD] = head
+
+        used = head - int(self.ctrl[TAIL])
+        if used > self.ctrl[HWM]:
+            self.ctrl[HWM] = used
+        return True
+
+    def _drop(self, n):
+        self.ctrl[DROPPED_FRAMES] += 1
+        self.ctrl[DROPPED_BYTES] += n
+
+    # returns (seq, t, board, payload) with payload a view into the ring, or None on
+    # timeout and once the writer has closed the ring and it is empty
+    def get(self, timeout=None):
+        self.release()
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            # CLOSED is read before HEAD so that no frame pushed before close is missed
+            closed = self.ctrl[CLOSED]
+            tail = int(self.ctrl[TAIL])
+            if int(self.ctrl[HEAD]) == tail:
+                if closed:
+                    return None
+                if deadline is not None and time.time() >= deadline:
+                    return None
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            pos = tail % self.capacity
+            end = self.capacity - pos
+            if end < FRAME_HEADER.size:
+                self.ctrl[TAIL] = tail + end
+                continue
+            seq, t, n, board = FRAME_HEADER.unpack_from(self.data, pos)
+            if n == WRAP:
+                self.ctrl[TAIL] = tail + end
+                continue
+
+            self.pending = FRAME_HEADER.size + padded_length(n)
+            start = pos + FRAME_HEADER.size
+            return seq, t, board, self.data[start:start + n]
+
+    # blocks until there is a frame to get (or the ring is closed), to time
+    # the idle wait apart from get() itself
+    def wait(self):
+        self.release()
+        while int(self.ctrl[HEAD]) == int(self.ctrl[TAIL]) and not self.ctrl[CLOSED]:
+            time.sleep(POLL_INTERVAL)
+
+    # hands the space of the last frame returned by get() back to the producer
+    def release(self):
+        if self.pending:
+            self.ctrl[TAIL] = int(self.ctrl[TAIL]) + self.pending
+            self.pending = 0
+
+    def record_consumed(self, hits, latency):
+        us = int(latency * 1e6)
+        self.ctrl[FRAMES_OUT] += 1
+        self.ctrl[HITS_OUT] += hits
+        self.ctrl[LATENCY_SUM] += us
+        if us > self.ctrl[LATENCY_MAX]:
+            self.ctrl[LATENCY_MAX] = us
+
+    # each counter is only incremented by one side
+    def count(self, counter, n=1):
+        self.ctrl[counter] += n
+
+    def reset_latency_max(self):
+        self.ctrl[LATENCY_MAX] = 0
+
+    def close_writer(self):
+        self.ctrl[CLOSED] = 1
+
+    def drained(self):
+        closed = self.ctrl[CLOSED]
+        return bool(closed) and self.ctrl[HEAD] == self.ctrl[TAIL]
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "used": int(self.ctrl[HEAD] - self.ctrl[TAIL]),
+            "high_water_mark": int(self.ctrl[HWM]),
+            "dropped_frames": int(self.ctrl[DROPPED_FRAMES]),
+            "dropped_bytes": int(self.ctrl[DROPPED_BYTES]),
+            "frames_parsed": int(self.ctrl[FRAMES_OUT]),
+            "hits_parsed": int(self.ctrl[HITS_OUT]),
+            "latency_sum_us": int(self.ctrl[LATENCY_SUM]),
+            "latency_max_us": int(self.ctrl[LATENCY_MAX]),
+            "frames_in": int(self.ctrl[FRAMES_IN]),
+            "bytes_in": int(self.ctrl[BYTES_IN]),
+            "blocked_us": int(self.ctrl[BLOCKED_US]),
+            "partial_frames": int(self.ctrl[PARTIAL_FRAMES]),
+            "raw_write_errors": int(self.ctrl[RAW_WRITE_ERRORS]),
+            "empty_frames": int(self.ctrl[EMPTY_FRAMES]),
+            "parse_errors": int(self.ctrl[PARSE_ERRORS]),
+            "parsed_write_errors": int(self.ctrl[PARSED_WRITE_ERRORS]),
+            "raw_queue_full": int(self.ctrl[RAW_QUEUE_FULL]),
+            "raw_queue_wait_us": int(self.ctrl[RAW_QUEUE_WAIT_US]),
+        }
+
+    def close(self):
+        self.ctrl = None
+        self.data = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # a payload view is still referenced, the mapping goes away with the process
+            pass
+
+    def unlink(self):
+        self.shm.unlink()
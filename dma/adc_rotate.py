@@ -0,0 +1,192 @@
+import csv
+import gzip
+import io
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+from buffered_output import BufferedOutput, FlushPolicy
+
+# Output rotation. A rotating writer wraps the writer of one output (raw
+# capture or parsed hits) and starts a new segment on a size or time
+# boundary, between two writes, so no data falls between segments. Closed
+# segments go to a background thread that compresses them and appends them
+# to the manifest, in the order they were written, together with the time
+# index of the segment if it has one (the index keeps pointing to offsets
+# in the uncompressed data, see open_stored).
+
+COMPRESS_CODECS = ["none", "gzip", "zstd", "lz4"]
+CODEC_EXT = {"gzip": ".gz", "zstd": ".zst", "lz4": ".lz4"}
+MANIFEST_FIELDS = ["Segment", "File", "Opened", "Closed", "Bytes", "Stored", "Stored_bytes", "Index"]
+
+
+class RotationPolicy:
+    def __init__(self, max_bytes=0, interval=0):
+        # 0 disables the corresponding criterion
+        self.max_bytes = max_bytes
+        self.interval = interval
+
+    @classmethod
+    def parse(cls, text):
+        # "hourly" or a comma-separated list like "bytes=1000000000,interval=3600"
+        if text == "hourly":
+            return cls(interval=3600)
+        policy = cls()
+        for item in text.split(","):
+            key, _, value = item.partition("=")
+            key = key.strip()
+            if key == "bytes":
+                policy.max_bytes = int(float(value))
+            elif key == "interval":
+                policy.interval = float(value)
+            else:
+                raise ValueError(f"E: unknown rotation item '{item}' - use bytes=, interval= or hourly")
+        return policy
+
+    def due(self, opened, nbytes, now):
+        # time boundaries are aligned to UTC multiples of the interval, e.g. full hours
+        return bool((self.max_bytes and nbytes >= self.max_bytes) or
+                    (self.interval and now // self.interval > opened // self.interval))
+
+
+def open_compressed(filename, codec):
+    if codec == "gzip":
+        return gzip.open(filename, "wb", compresslevel=6)
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor().stream_writer(open(filename, "wb"))
+    if codec == "lz4":
+        import lz4.frame
+        return lz4.frame.open(filename, "wb")
+    raise ValueError(f"E: unknown compression codec {codec}")
+
+
+def open_stored(filename):
+    # a segment for reading, compressed or not; offsets are those of the
+    # uncompressed data and seeking forward decompresses up to them
+    if os.path.exists(filename):
+        return open(filename, "rb")
+    for codec, ext in CODEC_EXT.items():
+        if os.path.exists(filename + ext):
+            if codec == "gzip":
+                return gzip.open(filename + ext, "rb")
+            if codec == "zstd":
+                import zstandard
+                return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filename + ext, "rb"), closefd=True))
+            import lz4.frame
+            return lz4.frame.open(filename + ext, "rb")
+    raise FileNotFoundError(f"E: {filename} not found, compressed or not")
+
+
+def check_codec(codec):
+    # fail at start-up rather than on the first closed segment
+    try:
+        if codec == "zstd":
+            import zstandard
+        elif codec == "lz4":
+            import lz4.frame
+    except ImportError:
+        print(f"E: --compress {codec} needs the {'zstandard' if codec == 'zstd' else 'lz4'} package")
+        sys.exit(-1)
+
+
+def compress_file(filename, codec):
+    # columnar segments are directories of already compressed groups
+    if codec == "none" or os.path.isdir(filename):
+        return filename
+    stored = filename + CODEC_EXT[codec]
+    tmp = stored + ".tmp"
+    with open(filename, "rb") as src, open_compressed(tmp, codec) as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(tmp, stored)
+    os.remove(filename)
+    return stored
+
+
+def stored_size(filename):
+    if os.path.isdir(filename):
+        return sum(e.stat().st_size for e in os.scandir(filename) if e.is_file())
+    return os.path.getsize(filename)
+
+
+def utc(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(t))
+
+
+class Compressor(threading.Thread):
+    def __init__(self, codec, manifest):
+        super().__init__(daemon=True)
+        self.codec = codec
+        self.manifest = BufferedOutput(manifest, FlushPolicy.parse("always"))
+        self.writer = csv.writer(self.manifest, dialect="excel")
+        self.writer.writerow(MANIFEST_FIELDS)
+        self.manifest.commit()
+        self.queue = queue.Queue()
+
+    def run(self):
+        while True:
+            segment = self.queue.get()
+            if segment is None:
+                break
+            seq, filename, opened, closed, nbytes, index = segment
+            try:
+                stored = compress_file(filename, self.codec)
+            except Exception as e:
+                print(f"E: compression of {filename} failed: {e}")
+                stored = filename
+            self.writer.writerow([seq, filename, utc(opened), utc(closed), nbytes, stored, stored_size(stored), index])
+            self.manifest.commit()
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+        self.manifest.close()
+
+
+class RotatingWriter:
+    def __init__(self, open_segment, segment_name, policy, codec="none", manifest=None):
+        # open_segment(filename) returns the writer of one segment, segment_name(seq) its file name
+        self.open_segment = open_segment
+        self.segment_name = segment_name
+        self.policy = policy
+        self.compressor = Compressor(codec, manifest)
+        self.compressor.start()
+        self.seq = 0
+        self.current = None
+        self.open_next()
+
+    def open_next(self):
+        # never overwrite the segments of an earlier run in the same hour
+        name = self.segment_name(self.seq)
+        while os.path.exists(name) or any(os.path.exists(name + ext) for ext in CODEC_EXT.values()):
+            self.seq += 1
+            name = self.segment_name(self.seq)
+        self.name = name
+        self.opened = time.time()
+        self.current = self.open_segment(name)
+        print(f"I: writing segment {name}")
+
+    def close_current(self):
+        self.current.close()
+        index = getattr(self.current, "index", None)
+        self.compressor.queue.put((self.seq, self.name, self.opened, time.time(), self.current.bytes_written,
+                                   index.file.name if index is not None else ""))
+        self.seq += 1
+
+    def write(self, *args):
+        if self.policy.due(self.opened, self.current.bytes_written, time.time()):
+            self.close_current()
+            self.open_next()
+        self.current.write(*args)
+
+    @property
+    def bytes_written(self):
+        return self.current.bytes_written
+
+    def close(self):
+        self.close_current()
+        self.compressor.stop()
@@ -0,0 +1,122 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+import zmq
+
+from adc_decode import COARSE_HZ, HIT_DTYPE, HIT_WORDS, encode_hits
+
+# Stand-in for the board DMA: a DEALER socket that sends frames of valid
+# 8-word hits to the ADC_parsing ROUTER.
+
+# channels 0 to 6 are simulated unless a channel mix is given
+DEFAULT_SIM_CHANNELS = 7
+
+
+def parse_channel_mix(text):
+    # "0,1,2" for a uniform mix or "0=4,1=1,2=1" with relative weights
+    channels = []
+    weights = []
+    for item in text.split(","):
+        ch, _, w = item.partition("=")
+        channels.append(int(ch))
+        weights.append(float(w) if w else 1.0)
+    weights = np.array(weights)
+    return np.array(channels, dtype=np.uint8), weights / weights.sum()
+
+
+class HitGenerator:
+    def __init__(self, channels, weights, crc_error=0.0, seed=None):
+        self.channels = channels
+        self.weights = weights
+        self.crc_error = crc_error
+        self.rng = np.random.default_rng(seed)
+        self.bad = 0
+
+    # n hits with time stamps spread over [t, t + span)
+    def make(self, n, t, span=0.0):
+        rng = self.rng
+        # whole seconds kept apart, a float unix time only resolves ~240 ns
+        sec = int(t)
+        frac = (t - sec) + np.sort(rng.random(n)) * span
+        hits = np.empty(n, dtype=HIT_DTYPE)
+        hits["Channel"] = rng.choice(self.channels, n, p=self.weights)
+        hits["Unix_time_16_bit"] = (sec + frac.astype(np.int64)) & 0xFFFF
+        hits["Coarse_time"] = (frac % 1.0) * COARSE_HZ
+        hits["TDC_time"] = rng.integers(0, 32, n)
+        hits["ToT_time"] = rng.integers(1, 64, n)
+        hits["TDC_trigger_end"] = rng.integers(0, 32, n)
+        hits["Energy"] = np.clip(rng.normal(2000, 400, n), 0, 0x3FFF)
+        hits["CRC"] = 0
+        words = encode_hits(hits)
+
+        if self.crc_error > 0:
+            bad = np.flatnonzero(rng.random(n) < self.crc_error)
+            # flip one bit of the hit word outside the CRC byte
+            word = rng.integers(1, 6, len(bad))
+            bit = rng.integers(0, 16, len(bad)).astype(np.uint16)
+            words[bad, word] ^= np.left_shift(np.uint16(1), bit)
+            self.bad += len(bad)
+        return words
+
+
+def simulate(endpoint, generator, rate, count, burst=1000, frame=100, board_id=1):
+    context = zmq.Context()
+    socket = context.socket(zmq.DEALER)
+    socket.setsockopt(zmq.IDENTITY, bytes([board_id]))
+    socket.connect(endpoint)
+    time.sleep(0.2)
+
+    sent = 0
+    start = time.perf_counter()
+    next_burst = start
+    t = 0.0
+    try:
+        while sent < count:
+            n = min(burst, count - sent)
+            span = n / rate if rate else 0.0
+            # a late burst must not overlap the time stamps of the previous one
+            t = max(time.time(), t)
+            words = generator.make(n, t, span)
+            t += span
+            for i in range(0, n, frame):
+                socket.send(words[i:i + frame].tobytes(), copy=False)
+            sent += n
+            if rate:
+                next_burst += span
+                delay = next_burst - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+    finally:
+        elapsed = time.perf_counter() - start
+        socket.close(linger=-1)
+        context.term()
+    return sent, elapsed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="synthetic ADC hit source for ADC_parsing")
+    parser.add_argument('--endpoint', action='store', type=str, help='ADC_parsing ROUTER endpoint (default: tcp://localhost:5555)', default="tcp://localhost:5555")
+    parser.add_argument('--channels', action='store', type=str, help='channel mix, e.g. 0,1,2 or 0=4,1=1 (default: all 7 channels)', default=",".join(str(c) for c in range(DEFAULT_SIM_CHANNELS)))
+    parser.add_argument('--rate', action='store', type=float, help='hits per second, 0 for as fast as possible (default: 10000)', default=10000)
+    parser.add_argument('--burst', action='store', type=int, help='hits generated per burst (default: 1000)', default=1000)
+    parser.add_argument('--frame', action='store', type=int, help='hits per ZMQ frame (default: 100)', default=100)
+    parser.add_argument('--crc-error', action='store', type=float, help='fraction of hits with a corrupted bit (default: 0)', default=0.0)
+    parser.add_argument('--count', action='store', type=int, help='number of hits to send (default: rate x duration)')
+    parser.add_argument('--duration', action='store', type=float, help='seconds to run (default: 10)', default=10)
+    parser.add_argument('--board-id', action='store', type=int, help='1-byte DEALER identity (default: 1)', default=1)
+    parser.add_argument('--seed', action='store', type=int, help='random seed')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    channels, weights = parse_channel_mix(args.channels)
+    generator = HitGenerator(channels, weights, args.crc_error, args.seed)
+    if args.count is None and args.rate == 0:
+        print("E: --rate 0 needs --count")
+        sys.exit(-1)
+    count = args.count if args.count is not None else int(args.rate * args.duration)
+    sent, elapsed = simulate(args.endpoint, generator, args.rate, count, args.burst, args.frame, args.board_id)
+    print(f"I: sent {sent} hits ({sent * HIT_WORDS * 2 / 1e6:.1f} MB, {generator.bad} with CRC errors) in {elapsed:.2f} s - {sent / elapsed:.0f} hits/s")
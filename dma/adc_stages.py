@@ -0,0 +1,46 @@
+# Parse stages run in the parser process on every decoded batch, in the
+# order they are listed, before the hits are written. A stage may change
+# the hits it passes on (drop, add columns, reorder) and may hold some back
+# until the end of the run.
+
+
+class ParseStage:
+    def output_dtype(self, dtype):
+        return dtype
+
+    def start(self):
+        pass
+
+    def process(self, hits):
+        return hits
+
+    # hits still held back at the end of the run
+    def finish(self):
+        return None
+
+    def close(self):
+        pass
+
+
+def output_dtype(stages, dtype):
+    for stage in stages:
+        dtype = stage.output_dtype(dtype)
+    return dtype
+
+
+def run_stages(stages, hits, first=0, perf=None):
+    for stage in stages[first:]:
+        hits = stage.process(hits)
+        if perf is not None and perf.timing:
+            perf.lap(type(stage).__name__)
+    return hits
+
+
+def finish_stages(stages):
+    # what a stage still holds goes through the stages after it
+    for i, stage in enumerate(stages):
+        tail = stage.finish()
+        if tail is not None and len(tail):
+            tail = run_stages(stages, tail, i + 1)
+            if len(tail):
+                yield tail
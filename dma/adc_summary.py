@@ -0,0 +1,149 @@
+import numpy as np
+
+from adc_decode import CHANNELS, CRC_FIELD
+from adc_events import UnixTimeUnwrapper
+from adc_output import open_hit_writer
+from adc_stages import ParseStage
+
+# Per-second summary: hit count, energy mean and RMS, ToT mean and CRC
+# failures, one row per second for every channel that had hits in it. The
+# sums are kept per (second, channel) as the batches go by; a second is
+# written once the stream is SUMMARY_DELAY seconds past it, so hits arriving
+# a little out of order still count. The stage runs before the CRC check:
+# with --crc tag or drop the failures are counted on the second the batch
+# arrived in (the time of a corrupted hit is not to be trusted) and left out
+# of the other columns. With --crc off the CRC is only a guess at the
+# firmware one: every hit counts and the failures are just reported.
+
+SUMMARY_DELAY = 2
+
+SUMMARY_DTYPE = np.dtype([
+    ("Second", np.uint64),
+    ("Channel", np.uint8),
+    ("Hits", np.uint32),
+    ("Energy_mean", np.float64),
+    ("Energy_rms", np.float64),
+    ("ToT_mean", np.float64),
+    ("CRC_failures", np.uint32),
+])
+
+# columns of the running sums
+HITS, ENERGY, ENERGY2, TOT, CRC_FAILURES = range(5)
+
+
+class SecondSummary:
+    def __init__(self, anchor=None, delay=SUMMARY_DELAY, crc_filter=True):
+        self.unwrapper = UnixTimeUnwrapper(anchor)
+        self.delay = delay
+        self.crc_filter = crc_filter
+        self.sums = {}
+        self.newest = None
+        self.written = None
+        self.late = 0
+
+    def add(self, second, ch, values, column):
+        # values per hit summed per channel into one column of second
+        sums = self.sums.get(second)
+        if sums is None:
+            sums = self.sums[second] = np.zeros((5, CHANNELS))
+        sums[column] += np.bincount(ch, weights=values, minlength=CHANNELS)
+
+    def push(self, hits):
+        if len(hits) == 0:
+            return self.rows([])
+        seconds = self.unwrapper.unwrap(hits["Unix_time_16_bit"])
+        ch = hits["Channel"].astype(np.intp)
+        ok = np.ones(len(hits), dtype=bool)
+        bad = np.zeros(len(hits), dtype=bool)
+        if CRC_FIELD in hits.dtype.names:
+            if self.crc_filter:
+                ok = hits[CRC_FIELD].astype(bool)
+            else:
+                # only reported, every hit counts
+                bad = ~hits[CRC_FIELD].astype(bool)
+        now = int(np.median(seconds[ok])) if ok.any() else self.newest
+        if now is not None:
+            self.newest = now if self.newest is None else max(self.newest, now)
+        if not ok.all() and self.newest is not None:
+            self.add(self.newest, ch[~ok], None, CRC_FAILURES)
+
+        seconds, ch = seconds[ok], ch[ok]
+        energy = hits["Energy"][ok].astype(np.float64)
+        tot = hits["ToT_time"][ok].astype(np.float64)
+        bad = bad[ok]
+        if self.written is not None:
+            late = seconds <= self.written
+            self.late += int(np.count_nonzero(late))
+            seconds, ch, energy, tot, bad = seconds[~late], ch[~late], energy[~late], tot[~late], bad[~late]
+        for second in np.unique(seconds):
+            sel = seconds == second
+            c = ch[sel]
+            self.add(int(second), c, None, HITS)
+            self.add(int(second), c, energy[sel], ENERGY)
+            self.add(int(second), c, energy[sel] ** 2, ENERGY2)
+            self.add(int(second), c, tot[sel], TOT)
+            if bad.any():
+                self.add(int(second), c[bad[sel]], None, CRC_FAILURES)
+
+        if self.newest is None:
+            return self.rows([])
+        return self.rows([s for s in self.sums if s < self.newest - self.delay])
+
+    def flush(self):
+        return self.rows(list(self.sums))
+
+    def rows(self, seconds):
+        seconds = sorted(seconds)
+        out = [self.second_rows(second, self.sums.pop(second)) for second in seconds]
+        if seconds:
+            self.written = max(seconds[-1], self.written or 0)
+        return np.concatenate(out) if out else np.empty(0, dtype=SUMMARY_DTYPE)
+
+    @staticmethod
+    def second_rows(second, sums):
+        active = np.flatnonzero(sums[HITS] + sums[CRC_FAILURES])
+        n = sums[HITS][active]
+        hits = np.maximum(n, 1)
+        mean = sums[ENERGY][active] / hits
+        rows = np.empty(len(active), dtype=SUMMARY_DTYPE)
+        rows["Second"] = second
+        rows["Channel"] = active
+        rows["Hits"] = n
+        rows["Energy_mean"] = np.round(mean, 3)
+        rows["Energy_rms"] = np.round(np.sqrt(np.maximum(sums[ENERGY2][active] / hits - mean ** 2, 0)), 3)
+        rows["ToT_mean"] = np.round(sums[TOT][active] / hits, 3)
+        rows["CRC_failures"] = sums[CRC_FAILURES][active]
+        return rows
+
+
+class SummaryStage(ParseStage):
+    def __init__(self, filename, parsed_format="csv", policy=None, anchor=None, crc_filter=True):
+        self.filename = filename
+        self.crc_filter = crc_filter
+        self.parsed_format = parsed_format
+        self.policy = policy
+        self.anchor = anchor
+        self.summary = None
+        self.out = None
+        self.rows = 0
+
+    def start(self):
+        self.summary = SecondSummary(self.anchor, crc_filter=self.crc_filter)
+        self.out = open_hit_writer(self.filename, self.parsed_format, self.policy, SUMMARY_DTYPE)
+
+    def write(self, rows):
+        if len(rows):
+            self.out.write(rows)
+            self.rows += len(rows)
+
+    def process(self, hits):
+        self.write(self.summary.push(hits))
+        return hits
+
+    def finish(self):
+        self.write(self.summary.flush())
+        return None
+
+    def close(self):
+        self.out.close()
+        print(f"I: summary: {self.rows} second/channel rows, {self.summary.late} hits too late for their second")
@@ -1,11 +1,21 @@
 import minimalmodbus
 import struct
+import time
+
+# registers 0x00...0x34 are read as one block and every getter decodes its
+# fields from it; the block is kept for BLOCK_TTL seconds (a few getters in
+# a row cost one transaction) and dropped on every write to the device
+BLOCK_START = 0x0000
+BLOCK_SIZE = 0x0035
+BLOCK_TTL = 0.2
 
 class HVModbus:
    def __init__(self):
       self.devset = [None] * 21     # 1...20 for new boards default address (20)
       self.dev = None
       self.address = None
+      self.blockTTL = BLOCK_TTL
+      self.blocks = {}              # device -> (time, registers)
 
    def open(self, serial, addr):
       if (self.probe(serial, addr)):
@@ -16,6 +26,7 @@ class HVModbus:
          self.dev.mode = minimalmodbus.MODE_RTU
          #self.dev.debug = True
          self.address = addr
+         self.blocks.clear()
          return True
       else:
          return False
@@ -43,6 +54,18 @@ class HVModbus:
 
       return found
 
+   def readBlock(self, d):
+      cached = self.blocks.get(d)
+      if cached and (time.monotonic() - cached[0]) < self.blockTTL:
+         return cached[1]
+      regs = d.read_registers(BLOCK_START, BLOCK_SIZE)
+      self.blocks[d] = (time.monotonic(), regs)
+      return regs
+
+   def invalidate(self, d=None):
+      if d is None: self.blocks.clear()
+      else: self.blocks.pop(d, None)
+
    def isConnected(self):
       return (self.address is not None)
 
@@ -52,44 +75,48 @@ class HVModbus:
    def getStatus(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
-      return d.read_register(0x0006)
+      return self.readBlock(d)[0x0006]
 
    def getVoltage(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
-      lsb = d.read_register(0x002A)
-      msb = d.read_register(0x002B)
+      regs = self.readBlock(d)
+      lsb = regs[0x002A]
+      msb = regs[0x002B]
       value = (msb << 16) + lsb
       return (value / 1000)
 
    def getVoltageSet(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
-      return d.read_register(0x0026)
+      return self.readBlock(d)[0x0026]
 
    def setVoltageSet(self, value, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_register(0x0026, value)
 
    def getCurrent(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
-      lsb = d.read_register(0x0028)
-      msb = d.read_register(0x0029)
+      regs = self.readBlock(d)
+      lsb = regs[0x0028]
+      msb = regs[0x0029]
       value = (msb << 16) + lsb
       return (value / 1000)
 
    def getTemperature(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
-      return d.read_register(0x0007)
+      return self.readBlock(d)[0x0007]
 
    def getRate(self, fmt=str, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
-      rup = d.read_register(0x0023)
-      rdn = d.read_register(0x0024)
+      regs = self.readBlock(d)
+      rup = regs[0x0023]
+      rdn = regs[0x0024]
       if (fmt == str):
          return f'{rup}/{rdn}' 
       else:
@@ -98,20 +125,23 @@ class HVModbus:
    def setRateRampup(self, value, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_register(0x0023, value, functioncode=6)
 
    def setRateRampdown(self, value, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_register(0x0024, value)
 
    def getLimit(self, fmt=str, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
-      lv = d.read_register(0x0027)
-      li = d.read_register(0x0025)
-      lt = d.read_register(0x002F)
-      ltt = d.read_register(0x0022)
+      regs = self.readBlock(d)
+      lv = regs[0x0027]
+      li = regs[0x0025]
+      lt = regs[0x002F]
+      ltt = regs[0x0022]
       if (fmt == str):
          return f'{lv}/{li}/{lt}/{ltt}'
       else:
@@ -120,93 +150,105 @@ class HVModbus:
    def setLimitVoltage(self, value, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_register(0x0027, value)
 
    def setLimitCurrent(self, value, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_register(0x0025, value)
 
    def setLimitTemperature(self, value, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_register(0x002F, value)
 
    def setLimitTriptime(self, value, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_register(0x0022, value)
 
    def setThreshold(self, value, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_register(0x002D, value)
 
    def getThreshold(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
-      return d.read_register(0x002D)
+      return self.readBlock(d)[0x002D]
 
    def getAlarm(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
-      return d.read_register(0x002E)
+      return self.readBlock(d)[0x002E]
 
    def getVref(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
-      return d.read_register(0x002C)
+      return self.readBlock(d)[0x002C]
 
    def powerOn(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_bit(1, True)
 
    def powerOff(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_bit(1, False)
 
    def reset(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_bit(2, True)
 
    def getInfo(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
-      fwver = d.read_string(0x0002, 1)
-      pmtsn = d.read_string(0x0008, 6)
-      hvsn = d.read_string(0x000E, 6)
-      febsn = d.read_string(0x0014, 6)
+      regs = self.readBlock(d)
+      fwver = registersToString(regs, 0x0002, 1)
+      pmtsn = registersToString(regs, 0x0008, 6)
+      hvsn = registersToString(regs, 0x000E, 6)
+      febsn = registersToString(regs, 0x0014, 6)
       return (fwver, pmtsn, hvsn, febsn)
 
    def setPMTSerialNumber(self, sn, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_string(0x0008, sn, 6)
 
    def setHVSerialNumber(self, sn, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_string(0x000E, sn, 6)
 
    def setFEBSerialNumber(self, sn, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_string(0x0014, sn, 6)
 
    def setModbusAddress(self, addr, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
+      self.invalidate(d)
       d.write_register(0x0000, addr)
 
    def readMonRegisters(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
       monData = {}
-      baseAddress = 0x0000
-      regs = d.read_registers(baseAddress, 48)
+      regs = self.readBlock(d)
       monData['status'] = regs[0x0006]
       monData['Vset'] = regs[0x0026]
       monData['V'] = ((regs[0x002B] << 16) + regs[0x002A]) / 1000
@@ -225,19 +267,20 @@ class HVModbus:
    def readCalibRegisters(self, devnum=None):
       if devnum: d = self.devset[devnum]
       else: d = self.dev
-      mlsb = d.read_register(0x0030)
-      mmsb = d.read_register(0x0031)
+      regs = self.readBlock(d)
+      mlsb = regs[0x0030]
+      mmsb = regs[0x0031]
       calibm = ((mmsb << 16) + mlsb)
       calibm = struct.unpack('l', struct.pack('L', calibm & 0xffffffff))[0]
       calibm = calibm / 10000
 
-      qlsb = d.read_register(0x0032)
-      qmsb = d.read_register(0x0033)
+      qlsb = regs[0x0032]
+      qmsb = regs[0x0033]
       calibq = ((qmsb << 16) + qlsb)
       calibq = struct.unpack('l', struct.pack('L', calibq & 0xffffffff))[0]
       calibq = calibq / 10000
 
-      calibt = d.read_register(0x0034)
+      calibt = regs[0x0034]
       calibt = calibt / 1.6890722
 
       return (calibm, calibq, calibt)
@@ -249,6 +292,7 @@ class HVModbus:
       lsb = (slope & 0xFFFF)
       msb = (slope >> 16) & 0xFFFF
 
+      self.invalidate(d)
       d.write_register(0x0030, lsb)
       d.write_register(0x0031, msb)
 
@@ -259,6 +303,7 @@ class HVModbus:
       lsb = (offset & 0xFFFF)
       msb = (offset >> 16) & 0xFFFF
 
+      self.invalidate(d)
       d.write_register(0x0032, lsb)
       d.write_register(0x0033, msb)
    
@@ -267,4 +312,9 @@ class HVModbus:
       else: d = self.dev
       discr = int(discr * 1.6890722)
 
+      self.invalidate(d)
       d.write_register(0x0034, discr)
+
+def registersToString(regs, address, count):
+   # same as read_string: two characters per register, high byte first
+   return b''.join(struct.pack('>H', r) for r in regs[address:address + count]).decode('ascii')
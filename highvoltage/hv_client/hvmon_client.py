@@ -9,6 +9,7 @@ import sys
 import time
 import json
 import copy
+from concurrent.futures import ThreadPoolExecutor
 
 from cmd2.table_creator import (
     Column,
@@ -22,6 +23,10 @@ from typing import (
 
 from hvmodbus import HVModbus
 
+# readings of this many cycles wait for the sender at most, a slow server
+# makes the pollers skip the oldest cycle instead of piling up readings
+QUEUE_CYCLES = 2
+
 def alarmString(alarmCode):
     msg = ' '
     if (alarmCode == 0):
@@ -61,7 +66,8 @@ def parse_args():
     parser.add_argument('--port', action='store', type=str, help='serial port device (default: /dev/ttyPS1)', default='/dev/ttyPS1')
     parser.add_argument('--ip', action='store', type=str, help='ip of the server (default: 172.16.24.10)', default='172.16.24.10')
     parser.add_argument('--freq', action='store', type=int, help='monitoring frequency (default: 1 second)', default=1)
-    parser.add_argument('-m', '--modules', help='comma-separated list of modules to monitor', required=True)
+    parser.add_argument('-m', '--modules', help='comma-separated list of modules to monitor on --port')
+    parser.add_argument('--bus', action='append', type=str, help='serial port and its modules, e.g. /dev/ttyPS2:4,5,6 (repeat for each RS-485 line, polled in parallel)', default=[])
     parser.add_argument('-f', '--filename', action='store', type=str, help='output filename')
     parser.add_argument('-l', '--filelabel', action='store', type=str, help='output filename <label>-<YYYYMMDD>-<HHMM>.csv')
     return parser.parse_args()
@@ -98,6 +104,64 @@ def check_modules(hv_mod_list, port):
             print(f'I: module {addr} ok')
     return hv_list
 
+"""Parse --port/--modules and every --bus into (port, module list) pairs"""
+def parse_buses(args):
+    buses = []
+    if args.modules:
+        try:
+            buses.append((args.port, [int(x) for x in args.modules.split(",")]))
+        except ValueError:
+            print('E: failed to parse --modules - should be comma-separated list of integers')
+            sys.exit(-1)
+    for bus in args.bus:
+        port, _, modules = bus.rpartition(":")
+        try:
+            buses.append((port, [int(x) for x in modules.split(",")]))
+        except ValueError:
+            print(f'E: failed to parse --bus {bus} - should be <port>:<comma-separated list of integers>')
+            sys.exit(-1)
+    if not buses:
+        print('E: no modules to monitor - use -m/--modules or --bus')
+        sys.exit(-1)
+    return buses
+
+"""One serial line: every Modbus transaction on it runs on a single worker thread, off
+the event loop, so each bus stays strictly serialized while different buses run in parallel
+and the websocket (pings included) keeps being served during slow transactions"""
+class HVBus:
+    def __init__(self, port, hv_mod_list):
+        self.port = port
+        self.hv_mod_list = hv_mod_list
+        self.hv_list = []
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'hvbus-{port}')
+
+    # runs a blocking call (anything touching the serial line) on the bus worker
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def open(self):
+        self.hv_list = await self.run(check_modules, self.hv_mod_list, self.port)
+
+    def read(self):
+        result = []
+        for hv in self.hv_list:
+            try:
+                mon = hv.readMonRegisters()
+            except Exception as e:
+                print(f'E: {self.port} address {hv.address} - {e}')
+                continue
+            mon['timestamp'] = int(time.time())
+            mon['time'] = datetime.datetime.now().strftime('%Y%m%d-%H%M')
+            mon['address'] = hv.address
+            result.append(mon)
+        return result
+
+    async def poll(self):
+        return await self.run(self.read)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
 def get_keys(hv):
     fields = list(hv.readMonRegisters().keys())
     fields.insert(0, 'timestamp')
@@ -106,6 +170,31 @@ def get_keys(hv):
     return fields
 
 
+"""Read all the buses at once every freq seconds, the cycle lasts as long as the slowest bus"""
+async def poll_buses(buses, queue, freq):
+    while True:
+        start = datetime.datetime.now()
+        readings = await asyncio.gather(*(bus.poll() for bus in buses))
+        if queue.full():
+            queue.get_nowait()
+            print('E: server too slow - skipping the oldest readings')
+        queue.put_nowait(readings)
+        stop = datetime.datetime.now()
+        delta = stop - start
+        await asyncio.sleep(((freq * 1000) - (delta.total_seconds() * 1000)) / 1000)
+
+"""Send and print the readings of each cycle as the pollers hand them over"""
+async def send_readings(websocket, queue):
+    while True:
+        readings = await queue.get()
+        for bus_readings in readings:
+            for mon in bus_readings:
+                mon['status'] = statusString(mon['status'])
+                mon['alarm'] = alarmString(mon['alarm'])
+                mon_data = json.dumps(mon)
+                await websocket.send(mon_data)
+                print(setup_table().generate_data_row([mon['address'], mon['status'], mon['Vset'], f'{mon["V"]:.3f}', f'{mon["I"]:.3f}', mon['T'], f'{mon["rateUP"]}/{mon["rateDN"]}', f'{mon["limitV"]}/{mon["limitI"]}/{mon["limitT"]}/{mon["limitTRIP"]}', mon['threshold'], mon['alarm']]))
+        header()
 
 async def send_data():
 
@@ -135,15 +224,10 @@ async def send_data():
         
 
 
-        try:
-            hvModList = [int(x) for x in args.modules.split(",")]
-        except ValueError:
-            print('E: failed to parse --reg - should be comma-separated list of integers')
-            sys.exit(-1)
-        
-        hv_list = check_modules(hvModList, args.port)
+        buses = [HVBus(port, hvModList) for port, hvModList in parse_buses(args)]
+        await asyncio.gather(*(bus.open() for bus in buses))
 
-        csv_message = json.dumps(get_keys(hv_list[0]))
+        csv_message = json.dumps(await buses[0].run(get_keys, buses[0].hv_list[0]))
         await websocket.send(csv_message)
 
         ack_message2 = await websocket.recv()
@@ -155,32 +239,14 @@ async def send_data():
         header()        
 
         try:
-            i = 1
-            while True:
-                start = datetime.datetime.now()
-                for hv in hv_list:
-                    try:
-                        mon = hv.readMonRegisters()
-                    except Exception as e:
-                        print(f'E: address {hv.address} - {e}')
-                        continue
-                    else:
-                        mon['timestamp'] = int(time.time())
-                        mon['time'] = datetime.datetime.now().strftime('%Y%m%d-%H%M')
-                        mon['address'] = hv.address
-                        mon['status'] = statusString(mon['status'])
-                        mon['alarm'] = alarmString(mon['alarm'])
-                        mon_data = json.dumps(mon)
-                        await websocket.send(mon_data)
-                        print(setup_table().generate_data_row([mon['address'], mon['status'], mon['Vset'], f'{mon["V"]:.3f}', f'{mon["I"]:.3f}', mon['T'], f'{mon["rateUP"]}/{mon["rateDN"]}', f'{mon["limitV"]}/{mon["limitI"]}/{mon["limitT"]}/{mon["limitTRIP"]}', mon['threshold'], mon['alarm']]))
-                
-                stop = datetime.datetime.now()
-                delta = stop - start
-                await asyncio.sleep(((args.freq * 1000) - (delta.total_seconds() * 1000)) / 1000)
-                header()
+            queue = asyncio.Queue(maxsize=QUEUE_CYCLES)
+            await asyncio.gather(poll_buses(buses, queue, args.freq), send_readings(websocket, queue))
 
         except KeyboardInterrupt:
             pass
+        finally:
+            for bus in buses:
+                bus.close()
 
 if __name__ == "__main__":
     asyncio.run(send_data())
@@ -4,11 +4,22 @@
 import asyncio
 import websockets
 import datetime
+import argparse
 import os
 import sys
 import csv
 import json
+import functools
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "common"))
+from buffered_output import BufferedOutput, FlushPolicy
+
+
+"""Parse command line arguments"""
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--flush', action='store', type=FlushPolicy.parse, help='output flush policy, e.g. bytes=65536,rows=10,interval=5 or always (default: interval=1)', default="interval=1")
+    return parser.parse_args()
 
 """Generate the output filename based on provided arguments"""
 def generate_filename(config_information):
@@ -34,7 +45,7 @@ def check_file_exists(fname):
                 sys.exit(-1)
 
 
-async def receive_data(websocket):
+async def receive_data(websocket, flush_policy=None):
 
 
     config_information = await websocket.recv()
@@ -50,7 +61,7 @@ async def receive_data(websocket):
     await websocket.send(ack_message)
 
 
-    with open(fname, "w", newline="") as file:
+    with BufferedOutput(fname, flush_policy) as file:
 
         keys_information = await websocket.recv()
         keys = json.loads(keys_information)
@@ -68,7 +79,7 @@ async def receive_data(websocket):
                 data = json.loads(message)
                 
                 writer.writerow(data)
-                file.flush()
+                file.commit()
 
             except websockets.exceptions.ConnectionClosedOK:
                 print("Connection closed normally.")
@@ -83,7 +94,8 @@ async def receive_data(websocket):
                 break
 
 async def main():
-    async with websockets.serve(receive_data, "0.0.0.0", 8002):
+    args = parse_args()
+    async with websockets.serve(functools.partial(receive_data, flush_policy=args.flush), "0.0.0.0", 8002):
         await asyncio.Future() 
 
 
@@ -4,17 +4,28 @@
 import asyncio
 import websockets
 import datetime
+import argparse
 import os
 import sys
 import csv
 import json
+import functools
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "common"))
+from buffered_output import BufferedOutput, FlushPolicy
 
 
 
 
 
 
+
+"""Parse command line arguments"""
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--flush', action='store', type=FlushPolicy.parse, help='output flush policy, e.g. bytes=65536,rows=10,interval=5 or always (default: interval=1)', default="interval=1")
+    return parser.parse_args()
+
 """Generate the output filename based on provided arguments"""
 def generate_filename(config_information):
     if config_information.get("filename"):
@@ -40,7 +51,7 @@ def check_file_exists(fname):
 
 
 
-async def receive_data(websocket):
+async def receive_data(websocket, flush_policy=None):
 
     config_information = await websocket.recv()
     command_information = json.loads(config_information)
@@ -54,7 +65,7 @@ async def receive_data(websocket):
     
 
 
-    with open(fname, "w", newline="") as file:
+    with BufferedOutput(fname, flush_policy) as file:
         writer = csv.DictWriter(file, fieldnames=["time", "register", "hex_value", "int_value"], dialect='excel')
         writer.writeheader()
 
@@ -74,7 +85,7 @@ async def receive_data(websocket):
                         "hex_value": data["hex_value"],
                         "int_value": data["int_value"]
                     })
-                    file.flush()
+                    file.commit()
 
             except websockets.exceptions.ConnectionClosedOK:
                 print("Connection closed normally.")
@@ -91,7 +102,8 @@ async def receive_data(websocket):
 
 
 async def main():
-    async with websockets.serve(receive_data, "0.0.0.0", 8001):
+    args = parse_args()
+    async with websockets.serve(functools.partial(receive_data, flush_policy=args.flush), "0.0.0.0", 8001):
         await asyncio.Future()  
 
 